@@ -0,0 +1,28 @@
+"""Long poll state table
+
+Revision ID: 5e1f7a2c9d04
+Revises: 3b9c02c44acf
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e1f7a2c9d04'
+down_revision = '3b9c02c44acf'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('LongPollState',
+    sa.Column('group_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('ts', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('group_id')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('LongPollState')
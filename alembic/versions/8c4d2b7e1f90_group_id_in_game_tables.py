@@ -0,0 +1,110 @@
+"""Group id in game tables
+
+Revision ID: 8c4d2b7e1f90
+Revises: 5e1f7a2c9d04
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c4d2b7e1f90'
+down_revision = '5e1f7a2c9d04'
+branch_labels = None
+depends_on = None
+
+
+def _drop_game_tables() -> None:
+    op.drop_table('CardCell')
+    op.drop_table('SessionPlayer')
+    op.drop_table('Barrel')
+    op.drop_table('Session')
+
+
+def upgrade() -> None:
+    # идущие игры нельзя отнести к сообществу, поэтому таблицы игр пересоздаются; статистика игроков остаётся
+    _drop_game_tables()
+    op.create_table('Session',
+    sa.Column('group_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('chat_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('type', sa.VARCHAR(length=45), nullable=False),
+    sa.Column('status', sa.VARCHAR(length=45), nullable=False),
+    sa.Column('start_date', sa.DATETIME(), nullable=False),
+    sa.Column('last_event_date', sa.DATETIME(), nullable=False),
+    sa.PrimaryKeyConstraint('group_id', 'chat_id')
+    )
+    op.create_table('Barrel',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('group_id', sa.Integer(), nullable=False),
+    sa.Column('bag_id', sa.Integer(), nullable=False),
+    sa.Column('barrel_number', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['group_id', 'bag_id'], ['Session.group_id', 'Session.chat_id'], name='_barrel_fk_', ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('group_id', 'bag_id', 'barrel_number', name='_barrel_uc_')
+    )
+    op.create_table('SessionPlayer',
+    sa.Column('group_id', sa.Integer(), nullable=False),
+    sa.Column('session_id', sa.Integer(), nullable=False),
+    sa.Column('player_id', sa.Integer(), nullable=False),
+    sa.Column('role', sa.VARCHAR(length=45), nullable=False),
+    sa.Column('card_number', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['group_id', 'session_id'], ['Session.group_id', 'Session.chat_id'], name='_session_player_fk_', ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['player_id'], ['Player.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('group_id', 'session_id', 'player_id')
+    )
+    op.create_table('CardCell',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('group_id', sa.Integer(), nullable=False),
+    sa.Column('session_id', sa.Integer(), nullable=False),
+    sa.Column('player_id', sa.Integer(), nullable=False),
+    sa.Column('row_index', sa.Integer(), nullable=False),
+    sa.Column('cell_index', sa.Integer(), nullable=False),
+    sa.Column('barrel_number', sa.Integer(), nullable=True),
+    sa.Column('is_covered', sa.BOOLEAN(), nullable=False),
+    sa.ForeignKeyConstraint(['group_id', 'session_id', 'player_id'], ['SessionPlayer.group_id', 'SessionPlayer.session_id', 'SessionPlayer.player_id'], name='_card_fk_', ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('group_id', 'session_id', 'player_id', 'row_index', 'cell_index', name='_card_uc_')
+    )
+
+
+def downgrade() -> None:
+    _drop_game_tables()
+    op.create_table('Session',
+    sa.Column('chat_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('type', sa.VARCHAR(length=45), nullable=False),
+    sa.Column('status', sa.VARCHAR(length=45), nullable=False),
+    sa.Column('start_date', sa.DATETIME(), nullable=False),
+    sa.Column('last_event_date', sa.DATETIME(), nullable=False),
+    sa.PrimaryKeyConstraint('chat_id')
+    )
+    op.create_table('Barrel',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('bag_id', sa.Integer(), nullable=False),
+    sa.Column('barrel_number', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['bag_id'], ['Session.chat_id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('bag_id', 'barrel_number', name='_barrel_uc_')
+    )
+    op.create_table('SessionPlayer',
+    sa.Column('session_id', sa.Integer(), nullable=False),
+    sa.Column('player_id', sa.Integer(), nullable=False),
+    sa.Column('role', sa.VARCHAR(length=45), nullable=False),
+    sa.Column('card_number', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['player_id'], ['Player.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['session_id'], ['Session.chat_id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('session_id', 'player_id')
+    )
+    op.create_table('CardCell',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('session_id', sa.Integer(), nullable=False),
+    sa.Column('player_id', sa.Integer(), nullable=False),
+    sa.Column('row_index', sa.Integer(), nullable=False),
+    sa.Column('cell_index', sa.Integer(), nullable=False),
+    sa.Column('barrel_number', sa.Integer(), nullable=True),
+    sa.Column('is_covered', sa.BOOLEAN(), nullable=False),
+    sa.ForeignKeyConstraint(['session_id', 'player_id'], ['SessionPlayer.session_id', 'SessionPlayer.player_id'], name='_card_fk_', ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('session_id', 'player_id', 'row_index', 'cell_index', name='_card_uc_')
+    )
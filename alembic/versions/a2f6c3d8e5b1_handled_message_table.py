@@ -0,0 +1,29 @@
+"""Handled message table
+
+Revision ID: a2f6c3d8e5b1
+Revises: 8c4d2b7e1f90
+Create Date: 2026-10-18 20:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a2f6c3d8e5b1'
+down_revision = '8c4d2b7e1f90'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('HandledMessage',
+    sa.Column('group_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('peer_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('message_id', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('group_id', 'peer_id')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('HandledMessage')
@@ -1,6 +1,6 @@
 import typing
 
-from app.admin.views import AdminCurrentView
+from app.admin.views import AdminCurrentView, BotStatsView
 
 if typing.TYPE_CHECKING:
     from app.web.app import Application
@@ -11,3 +11,4 @@ def setup_routes(app: "Application"):
 
     app.router.add_view("/admin.login", AdminLoginView)
     app.router.add_view("/admin.current", AdminCurrentView)
+    app.router.add_view("/admin.bot_stats", BotStatsView)
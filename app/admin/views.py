@@ -28,4 +28,16 @@ class AdminCurrentView(AuthRequiredMixin, View):
     async def get(self):
         admin = self.request.admin
         return json_response(data=AdminSchema().dump(admin))
-    
\ No newline at end of file
+    
+
+class BotStatsView(AuthRequiredMixin, View):
+    async def get(self):
+        return json_response(data={
+            "dispatcher": self.store.bots_manager.dispatcher.stats(),
+            "dedup": self.store.bots_manager.dedup.stats(),
+            "throttle": self.store.bots_manager.throttle.stats(),
+            "card_docs": self.store.bots_manager.russian_loto.card_docs.stats(),
+            "game_state": self.store.loto_state.stats(),
+            "picturbator": self.store.bots_manager.russian_loto.picturbator.stats(),
+            "vk_api": self.store.vk_api.stats(),
+        })
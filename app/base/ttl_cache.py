@@ -0,0 +1,40 @@
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+
+class TTLCache:
+    """Словарь, записи которого устаревают через ttl секунд; при maxsize вытесняет самые старые"""
+
+    def __init__(self, ttl: float, maxsize: Optional[int] = None):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.items: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        item = self.items.get(key)
+        if item is None or item[0] < time.monotonic():
+            self.items.pop(key, None)
+            self.misses += 1
+            return None
+        self.items.move_to_end(key)
+        self.hits += 1
+        return item[1]
+
+    def set(self, key: Hashable, value: Any):
+        self.items[key] = (time.monotonic() + self.ttl, value)
+        self.items.move_to_end(key)
+        if self.maxsize is not None and len(self.items) > self.maxsize:
+            self.items.popitem(last=False)
+
+    def invalidate(self, key: Hashable):
+        self.items.pop(key, None)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self.items),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
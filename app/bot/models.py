@@ -0,0 +1,35 @@
+from dataclasses import dataclass
+
+from app.store.database.sqlalchemy_base import db
+from sqlalchemy import (
+    Column,
+    Integer,
+    BigInteger
+)
+
+
+@dataclass
+class LongPollState:
+    group_id: int
+    ts: int
+
+
+class LongPollStateModel(db):
+    __tablename__ = "LongPollState"
+    group_id = Column(Integer, primary_key=True, autoincrement=False)
+    ts = Column(BigInteger, nullable=False)
+
+    def __repr__(self) -> str:
+        return f"<LongPollStateModel(group_id='{self.group_id}', ts='{self.ts}')>"
+
+
+class HandledMessageModel(db):
+    __tablename__ = "HandledMessage"
+    group_id = Column(Integer, primary_key=True, autoincrement=False)
+    peer_id = Column(Integer, primary_key=True, autoincrement=False)
+    # conversation_message_id последней выполненной команды беседы
+    message_id = Column(Integer, nullable=False)
+
+    def __repr__(self) -> str:
+        return f"<HandledMessageModel(group_id='{self.group_id}', peer_id='{self.peer_id}', " \
+               f"message_id='{self.message_id}')>"
@@ -0,0 +1,32 @@
+import hmac
+
+from aiohttp.web import HTTPBadRequest, HTTPForbidden, HTTPServiceUnavailable, Response
+
+from app.web.app import View
+
+
+class VkCallbackView(View):
+    async def post(self):
+        try:
+            event = await self.request.json()
+        except ValueError:
+            raise HTTPBadRequest
+        if not isinstance(event, dict) or not isinstance(event.get("type"), str):
+            raise HTTPBadRequest
+        config = self.request.app.config
+        group = self.store.vk_api.groups.get(event.get("group_id"))
+        if group is None:
+            raise HTTPForbidden
+        if event["type"] == "confirmation":
+            return Response(text=group.config.confirmation or config.callback.confirmation)
+        secret = group.config.secret or config.callback.secret
+        if not hmac.compare_digest(str(event.get("secret", "")).encode(), secret.encode()):
+            raise HTTPForbidden
+        if not isinstance(event.get("object", {}), dict):
+            raise HTTPBadRequest
+
+        # VK ждёт "ok" быстро, поэтому событие только ставится в очередь, а обрабатывается позже;
+        # места в очереди оно не ждёт: не принятое событие VK пришлёт повторно, если ответ не "ok"
+        if not group.poller.offer([event]):
+            raise HTTPServiceUnavailable
+        return Response(text="ok")
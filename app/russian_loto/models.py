@@ -18,6 +18,7 @@ from sqlalchemy.orm import relationship
 
 @dataclass
 class GameSession:
+    group_id: int
     chat_id: int
     start_date: datetime
     last_event_date: datetime
@@ -62,6 +63,8 @@ class CardCell:
 
 class GameSessionModel(db):
     __tablename__ = "Session"
+    # peer_id бесед нумеруются в каждом сообществе отдельно, поэтому беседа определяется парой
+    group_id = Column(Integer, primary_key=True, autoincrement=False)
     chat_id = Column(Integer, primary_key=True, autoincrement=False)
     type = Column(VARCHAR(45), nullable=False, default="simple")
     status = Column(VARCHAR(45), nullable=False, default="started")
@@ -71,7 +74,8 @@ class GameSessionModel(db):
     session_player = relationship("SessionPlayerModel")
 
     def __repr__(self) -> str:
-        return f"<GameSessionModel(chat_id='{self.chat_id}', type='{self.type}', status='{self.status}', " \
+        return f"<GameSessionModel(group_id='{self.group_id}', chat_id='{self.chat_id}', type='{self.type}', " \
+               f"status='{self.status}', " \
                f"start_date='{self.start_date}', last_event_date='{self.last_event_date}')>"
 
 
@@ -92,31 +96,48 @@ class PlayerModel(db):
 class BarrelModel(db):
     __tablename__ = "Barrel"
     id = Column(Integer, primary_key=True)
-    bag_id = Column(Integer, ForeignKey("Session.chat_id", ondelete="CASCADE"), nullable=False)
+    group_id = Column(Integer, nullable=False)
+    bag_id = Column(Integer, nullable=False)
     barrel_number = Column(Integer, nullable=False)
 
-    __table_args__ = (UniqueConstraint("bag_id", "barrel_number", name="_barrel_uc_"),)
+    __table_args__ = (
+        UniqueConstraint("group_id", "bag_id", "barrel_number", name="_barrel_uc_"),
+        ForeignKeyConstraint(
+            ["group_id", "bag_id"], ["Session.group_id", "Session.chat_id"], ondelete="CASCADE", name="_barrel_fk_"
+        )
+    )
 
     def __repr__(self) -> str:
-        return f"<BarrelModel(id='{self.id}', bag_id='{self.bag_id}', barrel_number='{self.barrel_number}')>"
+        return f"<BarrelModel(id='{self.id}', group_id='{self.group_id}', bag_id='{self.bag_id}', " \
+               f"barrel_number='{self.barrel_number}')>"
 
 
 class SessionPlayerModel(db):
     __tablename__ = "SessionPlayer"
-    session_id = Column(Integer, ForeignKey("Session.chat_id", ondelete="CASCADE"), primary_key=True)
+    group_id = Column(Integer, primary_key=True)
+    session_id = Column(Integer, primary_key=True)
     player_id = Column(Integer, ForeignKey("Player.id", ondelete="CASCADE"), primary_key=True)
     role = Column(VARCHAR(45), nullable=False, default="lead")
     card_number = Column(Integer, nullable=True)
     # card_cell = relationship("CardCellModel")
 
+    __table_args__ = (
+        ForeignKeyConstraint(
+            ["group_id", "session_id"], ["Session.group_id", "Session.chat_id"],
+            ondelete="CASCADE", name="_session_player_fk_"
+        ),
+    )
+
     def __repr__(self) -> str:
-        return f"<SessionPlayerModel(session_id='{self.session_id}', player_id='{self.player_id}', " \
+        return f"<SessionPlayerModel(group_id='{self.group_id}', session_id='{self.session_id}', " \
+               f"player_id='{self.player_id}', " \
                f"role='{self.role}', card_number='{self.card_number}')>"
 
 
 class CardCellModel(db):
     __tablename__ = "CardCell"
     id = Column(Integer, primary_key=True, autoincrement=True)
+    group_id = Column(Integer, nullable=False)
     session_id = Column(Integer, nullable=False)
     player_id = Column(Integer, nullable=False)
     row_index = Column(Integer, nullable=False)
@@ -125,14 +146,16 @@ class CardCellModel(db):
     is_covered = Column(BOOLEAN, nullable=False, default=False)
 
     __table_args__ = (
-        UniqueConstraint("session_id", "player_id", "row_index", "cell_index", name="_card_uc_"),
+        UniqueConstraint("group_id", "session_id", "player_id", "row_index", "cell_index", name="_card_uc_"),
         ForeignKeyConstraint(
-            ["session_id", "player_id"], ["SessionPlayer.session_id", "SessionPlayer.player_id"],
+            ["group_id", "session_id", "player_id"],
+            ["SessionPlayer.group_id", "SessionPlayer.session_id", "SessionPlayer.player_id"],
             ondelete="CASCADE", name="_card_fk_"
         )
     )
 
     def __repr__(self) -> str:
-        return f"<CardCellModel(id='{self.id}', session_id='{self.session_id}', player_id='{self.player_id}', " \
+        return f"<CardCellModel(id='{self.id}', group_id='{self.group_id}', session_id='{self.session_id}', " \
+               f"player_id='{self.player_id}', " \
                f"row_index='{self.row_index}', cell_index='{self.cell_index}', barrel_number='{self.barrel_number}', " \
                f"is_covered='{self.is_covered}')>"
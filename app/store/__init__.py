@@ -10,11 +10,15 @@ class Store:
     def __init__(self, app: "Application"):
         from app.store.bot.manager import BotManager
         from app.store.admin.accessor import AdminAccessor
+        from app.store.bot.accessor import LongPollStateAccessor
         from app.store.russian_loto.accessor import RussianLotoAccessor
+        from app.store.russian_loto.state import GameStateEngine
         from app.store.vk_api.accessor import VkApiAccessor
 
         self.admins = AdminAccessor(app)
         self.loto_games = RussianLotoAccessor(app)
+        self.loto_state = GameStateEngine(app)
+        self.long_poll_states = LongPollStateAccessor(app)
         self.vk_api = VkApiAccessor(app)
         self.bots_manager = BotManager(app)
 
@@ -22,6 +26,9 @@ class Store:
 def setup_store(app: "Application"):
     app.database = Database(app)
     app.on_startup.append(app.database.connect)
-    app.on_cleanup.append(app.database.disconnect)
     app.store = Store(app)
+    # состояние игр дописывается после остановки обработчиков, иначе изменения последних ходов потерялись бы
+    app.on_cleanup.append(app.store.loto_state.close)
+    # база закрывается последней: при остановке пуллеры дожидаются обработки и сохраняют ts
+    app.on_cleanup.append(app.database.disconnect)
     
\ No newline at end of file
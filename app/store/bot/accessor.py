@@ -0,0 +1,29 @@
+from typing import Optional
+
+from sqlalchemy import select, ChunkedIteratorResult
+from sqlalchemy.dialects.mysql import insert
+
+from app.base.base_accessor import BaseAccessor
+from app.bot.models import LongPollState, LongPollStateModel
+
+
+class LongPollStateAccessor(BaseAccessor):
+    async def get_state(self, group_id: int) -> Optional[LongPollState]:
+        query_get_state = select(LongPollStateModel).where(LongPollStateModel.group_id == group_id)
+
+        async with self.app.database.session() as get_session:
+            res: ChunkedIteratorResult = await get_session.execute(query_get_state)
+            result = res.scalar()
+            await get_session.commit()
+
+        if result is None:
+            return result
+        return LongPollState(group_id=result.group_id, ts=result.ts)
+
+    async def save_ts(self, group_id: int, ts: int):
+        query_save_ts = insert(LongPollStateModel).values(group_id=group_id, ts=ts)
+        query_save_ts = query_save_ts.on_duplicate_key_update(ts=query_save_ts.inserted.ts)
+
+        async with self.app.database.session() as save_session:
+            await save_session.execute(query_save_ts)
+            await save_session.commit()
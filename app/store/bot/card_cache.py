@@ -0,0 +1,63 @@
+from typing import Hashable, Optional
+
+from app.base.ttl_cache import TTLCache
+from app.russian_loto.models import CardCell
+
+
+class CardDocCache:
+    """Уже загруженные в VK карточки игроков, сгруппированные по сессиям.
+
+    Вложение определяется ключом (номер карточки и игрок или номер общего изображения) и маской закрытых
+    ячеек: пока маска не изменилась, вместо новой отрисовки и загрузки переиспользуется прежнее вложение.
+    Закрытые ячейки не открываются, поэтому на ключ хранится только последняя маска.
+    """
+
+    COLUMNS_AMOUNT = 9
+
+    def __init__(self, ttl: float, max_sessions: int):
+        self.sessions = TTLCache(ttl, max_sessions)
+        # в карточках: общее изображение из нескольких карточек считается за каждую
+        self.reused = 0  # не отрисованы и не загружены заново
+        self.rendered = 0
+        self.uploaded = 0
+
+    @classmethod
+    def coverage_mask(cls, card: list[CardCell]) -> int:
+        mask = 0
+        for card_cell in card:
+            if card_cell.is_covered:
+                mask |= 1 << ((card_cell.row_index - 1) * cls.COLUMNS_AMOUNT + card_cell.cell_index - 1)
+        return mask
+
+    def get(self, session_key: Hashable, key: Hashable, mask: Hashable) -> Optional[str]:
+        docs = self.sessions.get(session_key)
+        mask_and_doc = docs.get(key) if docs else None
+        if mask_and_doc is not None and mask_and_doc[0] == mask:
+            return mask_and_doc[1]
+        return None
+
+    def count(self, reused: int = 0, rendered: int = 0, uploaded: int = 0):
+        self.reused += reused
+        self.rendered += rendered
+        self.uploaded += uploaded
+
+    def set(self, session_key: Hashable, key: Hashable, mask: Hashable, doc_ref: str):
+        if not doc_ref:
+            return  # не загрузилось - в следующий раз карточку нужно отрисовать заново
+        docs = self.sessions.get(session_key)
+        if docs is None:
+            docs = {}
+            self.sessions.set(session_key, docs)
+        docs[key] = (mask, doc_ref)
+
+    def evict(self, session_key: Hashable):
+        self.sessions.invalidate(session_key)
+
+    def stats(self) -> dict:
+        return {
+            "sessions": len(self.sessions.items),
+            "cards_reused": self.reused,
+            "cards_rendered": self.rendered,
+            "cards_uploaded": self.uploaded,
+            "cards_not_uploaded": self.rendered - self.uploaded,
+        }
@@ -0,0 +1,333 @@
+import io
+import os
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from logging import getLogger
+from typing import Optional
+
+from PIL import Image, ImageDraw, ImageFont
+
+
+@dataclass
+class EncodeOptions:
+    palette: int = 0  # 0 - полноцветный PNG, иначе количество цветов палитры
+    compress_level: int = 6
+    optimize: bool = False
+    scale: float = 1.0
+
+
+@dataclass(slots=True)
+class CardData:
+    number: int
+    numbers: list[list[Optional[int]]]  # 3 строки по 9 ячеек, None - пустая ячейка
+    covered: list[list[bool]]
+    caption: list[str]
+
+
+def load_font(names: list[str], size: int) -> ImageFont.ImageFont | ImageFont.FreeTypeFont:
+    """Первый найденный в системе шрифт из списка, иначе встроенный растровый"""
+
+    for name in names:
+        if not name:
+            continue
+        try:
+            return ImageFont.truetype(name, size)
+        except OSError:
+            continue
+    getLogger("renderer").warning(f"none of fonts {names} found, falling back to the default one")
+    return ImageFont.load_default()
+
+
+TEXT_COVERED = "❌"
+TEXT_EMPTY = "⬜"
+
+
+def card_to_text(card: CardData) -> str:
+    """Карточка текстом прямо в сообщении: подпись и сетка 3×9, где закрытые числа заменены крестиками"""
+
+    rows = [
+        " ".join(
+            TEXT_EMPTY if number is None else TEXT_COVERED if is_covered else f"{number:02}"
+            for number, is_covered in zip(numbers, covered)
+        ) for numbers, covered in zip(card.numbers, card.covered)
+    ]
+    # сообщения передаются в VK как есть, поэтому перенос строки - %0A, как и в остальных текстах бота
+    return "%0A".join([", ".join(card.caption), *rows])
+
+
+class CardRenderer(ABC):
+    """Общая часть отрисовщиков: кодирование в PNG и сборка нескольких карточек в одно изображение"""
+
+    WHITE = (255, 255, 255)
+
+    def __init__(self, encoding: Optional[EncodeOptions] = None):
+        self.encoding = encoding or EncodeOptions()
+
+    def warm_up(self, cards: dict[int, list[list[Optional[int]]]]):
+        return
+
+    @abstractmethod
+    def render(self, card: CardData) -> Image.Image:
+        ...
+
+    def encode(self, image: Image.Image) -> bytes:
+        # на карточках всего несколько цветов, поэтому палитра почти не меняет картинку, но сильно уменьшает файл
+        encoding = self.encoding
+        if encoding.scale != 1.0:
+            size = (round(image.width * encoding.scale), round(image.height * encoding.scale))
+            image = image.resize(size, Image.LANCZOS)
+        if encoding.palette:
+            image = image.quantize(encoding.palette, method=Image.Quantize.FASTOCTREE, dither=Image.Dither.NONE)
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG", compress_level=encoding.compress_level, optimize=encoding.optimize)
+        return buffer.getvalue()
+
+    def to_bytes(self, card: CardData) -> bytes:
+        return self.encode(self.render(card))
+
+    def composite(self, cards: list[CardData], columns: int) -> Image.Image:
+        pictures = [self.render(card) for card in cards]
+        width = max(picture.width for picture in pictures)
+        height = max(picture.height for picture in pictures)
+        rows = -(-len(pictures) // columns)
+        image = Image.new("RGB", (width * min(columns, len(pictures)), height * rows), self.WHITE)
+        for k, picture in enumerate(pictures):
+            image.paste(picture, (k % columns * width, k // columns * height))
+        return image
+
+    def composite_to_bytes(self, cards: list[CardData], columns: int) -> bytes:
+        return self.encode(self.composite(cards, columns))
+
+
+class PillowCardRenderer(CardRenderer):
+    """Рисует карточку лото сразу в растр из заранее подготовленных частей.
+
+    Для каждого номера карточки один раз рисуется шаблон: заголовки, сетка 3×9 и числа. Хранится он
+    в виде байтов в оттенках серого, потому что в нём только чёрный и белый. Закрытые ячейки тоже
+    готовятся заранее, по одной на каждое число: бочонок и красное число. Отрисовка хода - это копия
+    шаблона, наложение закрытых ячеек и подпись. Общее изображение нескольких карточек собирается
+    из тех же частей сразу на общем холсте.
+    """
+
+    RED = (226, 13, 19)
+    BLACK = (0, 0, 0)
+    WHITE = (255, 255, 255)
+    COLUMNS_AMOUNT = 9
+    ROWS_AMOUNT = 3
+    BARRELS_AMOUNT = 90
+    CELL_SIZE = 56
+    INDEX_WIDTH = 28
+    HEADER_HEIGHT = 28
+    CAPTION_LINES = 2
+    CAPTION_LINE_HEIGHT = 20
+    PADDING = 8
+    NUMBER_FONTS = ["DejaVuSans-Bold.ttf", "arialbd.ttf"]
+    HEADER_FONTS = ["DejaVuSans-Bold.ttf", "arialbd.ttf"]
+    CAPTION_FONTS = ["DejaVuSans-Oblique.ttf", "ariali.ttf", "DejaVuSans.ttf", "arial.ttf"]
+
+    def __init__(
+            self, barrel_path: str, font: str = "", caption_font: str = "", encoding: Optional[EncodeOptions] = None
+    ):
+        super().__init__(encoding)
+        self.number_font = load_font([font, *self.NUMBER_FONTS], 32)  # 24pt
+        self.header_font = load_font([font, *self.HEADER_FONTS], 14)
+        self.caption_font = load_font([caption_font, *self.CAPTION_FONTS], 16)  # 12pt
+        with Image.open(barrel_path) as barrel:
+            self.barrel = barrel.convert("RGBA").resize((self.CELL_SIZE, self.CELL_SIZE), Image.LANCZOS)
+        self.size = (
+            2 * self.PADDING + self.INDEX_WIDTH + self.COLUMNS_AMOUNT * self.CELL_SIZE,
+            2 * self.PADDING + self.CAPTION_LINES * self.CAPTION_LINE_HEIGHT + self.HEADER_HEIGHT +
+            self.ROWS_AMOUNT * self.CELL_SIZE
+        )
+        self.grid_left = self.PADDING + self.INDEX_WIDTH
+        self.grid_top = self.PADDING + self.CAPTION_LINES * self.CAPTION_LINE_HEIGHT + self.HEADER_HEIGHT
+        self.templates: dict[int, bytes] = {}
+        self.covered_cells: dict[int, Image.Image] = {}
+
+    @staticmethod
+    def _draw_centered(draw: ImageDraw.ImageDraw, box: tuple[int, int, int, int], text: str, font, fill):
+        left, top, right, bottom = font.getbbox(text)
+        x = (box[0] + box[2] - (right - left)) // 2 - left
+        y = (box[1] + box[3] - (bottom - top)) // 2 - top
+        draw.text((x, y), text, font=font, fill=fill)
+
+    def _cell_position(self, i: int, j: int, origin: tuple[int, int] = (0, 0)) -> tuple[int, int]:
+        return origin[0] + self.grid_left + j * self.CELL_SIZE, origin[1] + self.grid_top + i * self.CELL_SIZE
+
+    def _draw_template(self, numbers: list[list[Optional[int]]]) -> Image.Image:
+        image = Image.new("L", self.size, 255)
+        draw = ImageDraw.Draw(image)
+
+        header_top = self.grid_top - self.HEADER_HEIGHT
+        for j in range(self.COLUMNS_AMOUNT):
+            left, _ = self._cell_position(0, j)
+            box = (left, header_top, left + self.CELL_SIZE, self.grid_top)
+            self._draw_centered(draw, box, str(j + 1), self.header_font, 0)
+
+        for i in range(self.ROWS_AMOUNT):
+            _, top = self._cell_position(i, 0)
+            box = (self.PADDING, top, self.grid_left, top + self.CELL_SIZE)
+            self._draw_centered(draw, box, str(i + 1), self.header_font, 0)
+            for j in range(self.COLUMNS_AMOUNT):
+                left, top = self._cell_position(i, j)
+                box = (left, top, left + self.CELL_SIZE, top + self.CELL_SIZE)
+                draw.rectangle(box, outline=0)
+                if numbers[i][j]:
+                    self._draw_centered(draw, box, str(numbers[i][j]), self.number_font, 0)
+        return image
+
+    def _draw_covered_cell(self, number: int) -> Image.Image:
+        # на клетку больше ячейки, чтобы правая и нижняя граница тоже были на месте
+        cell = Image.new("RGB", (self.CELL_SIZE + 1, self.CELL_SIZE + 1), self.WHITE)
+        cell.paste(self.barrel, (0, 0), self.barrel)
+        draw = ImageDraw.Draw(cell)
+        draw.rectangle((0, 0, self.CELL_SIZE, self.CELL_SIZE), outline=self.BLACK)
+        self._draw_centered(draw, (0, 0, self.CELL_SIZE, self.CELL_SIZE), str(number), self.number_font, self.RED)
+        return cell
+
+    def warm_up(self, cards: dict[int, list[list[Optional[int]]]]):
+        """Заранее готовит шаблоны переданных карточек и закрытые ячейки всех чисел"""
+
+        for card_number, numbers in cards.items():
+            self.templates[card_number] = self._draw_template(numbers).tobytes()
+        for number in range(1, self.BARRELS_AMOUNT + 1):
+            self.covered_cells[number] = self._draw_covered_cell(number)
+
+    def _template(self, card: CardData) -> Image.Image:
+        template = self.templates.get(card.number)
+        if template is None:
+            template = self.templates[card.number] = self._draw_template(card.numbers).tobytes()
+        return Image.frombytes("L", self.size, template).convert("RGB")
+
+    def _covered_cell(self, number: int) -> Image.Image:
+        cell = self.covered_cells.get(number)
+        if cell is None:
+            cell = self.covered_cells[number] = self._draw_covered_cell(number)
+        return cell
+
+    def _draw_card(self, image: Image.Image, card: CardData, origin: tuple[int, int]):
+        for i, row in enumerate(card.numbers):
+            for j, number in enumerate(row):
+                if number and card.covered[i][j]:
+                    image.paste(self._covered_cell(number), self._cell_position(i, j, origin))
+
+        draw = ImageDraw.Draw(image)
+        for k, line in enumerate(card.caption[:self.CAPTION_LINES]):
+            position = (origin[0] + self.PADDING, origin[1] + self.PADDING + k * self.CAPTION_LINE_HEIGHT)
+            draw.text(position, line, font=self.caption_font, fill=self.BLACK)
+
+    def render(self, card: CardData) -> Image.Image:
+        image = self._template(card)
+        self._draw_card(image, card, (0, 0))
+        return image
+
+    def composite(self, cards: list[CardData], columns: int) -> Image.Image:
+        width, height = self.size
+        rows = -(-len(cards) // columns)
+        image = Image.new("RGB", (width * min(columns, len(cards)), height * rows), self.WHITE)
+        for k, card in enumerate(cards):
+            origin = (k % columns * width, k // columns * height)
+            image.paste(self._template(card), origin)
+            self._draw_card(image, card, origin)
+        return image
+
+
+class DataFrameCardRenderer(CardRenderer):
+    """Прежняя отрисовка через pandas Styler и dataframe_image; pandas загружается только при выборе этого бэкенда"""
+
+    RED = '#E20D13'
+    SHIFT_I = 1
+    SHIFT_J = 2
+    TABLE_STYLES = [
+        {
+            'selector': 'th', 'props': 'text-align: center; background-color: white;'
+        },
+        {
+            'selector': 'th:nth-child(1)', 'props': 'border-top: 1px solid white;'
+        },
+        {
+            'selector': 'td', 'props': [
+                ('font-size', '24pt'), ('font-weight', 'bold'), ('border', '1px solid black'),
+                ('text-align', 'center'), ('width', '44px'), ('border-color', 'black')
+            ]
+        },
+        {
+            'selector': 'caption', 'props': [
+                ('text-align', 'left'), ('font-size', '12pt'), ('font-weight', 'normal'), ('font-style', 'italic')
+            ]
+        }
+    ]
+    COLUMNS = ["1", "2", "3", "4", "5", "6", "7", "8", "9"]
+    INDEXES = ["1", "2", "3"]
+
+    def __init__(self, barrel_path: str, encoding: Optional[EncodeOptions] = None):
+        super().__init__(encoding)
+        self.barrel_path = barrel_path
+
+    def render(self, card: CardData) -> Image.Image:
+        return Image.open(io.BytesIO(self._export(card))).convert("RGB")
+
+    def to_bytes(self, card: CardData) -> bytes:
+        picture = self._export(card)
+        if self.encoding == EncodeOptions():
+            return picture  # dataframe_image уже отдаёт PNG, перекодировать нечего
+        return self.encode(Image.open(io.BytesIO(picture)).convert("RGB"))
+
+    def _export(self, card: CardData) -> bytes:
+        from pandas import DataFrame
+        from dataframe_image import export
+
+        card_numbers = [[str(number) if number else "" for number in row] for row in card.numbers]
+        t_styles = self.TABLE_STYLES.copy()
+        df = DataFrame(card_numbers, columns=self.COLUMNS, index=self.INDEXES)
+        for i, row in enumerate(card_numbers):
+            for j, cell in enumerate(row):
+                props = [
+                    ('background-repeat', 'no-repeat'), ('background-position', 'center'),
+                    ('background-size', '64px 64px'),
+                    ('background-image', f'url("{self.barrel_path}")'), ('color', self.RED)
+                ] if (cell and card.covered[i][j] is True) else []
+
+                t_styles.append(
+                    {'selector': f'tr:nth-child({i + self.SHIFT_I}) td:nth-child({j + self.SHIFT_J})', 'props': props})
+
+        df_styled = df.style.set_table_styles(t_styles)
+        df_styled.set_caption("<br>".join(card.caption))
+        buffer = io.BytesIO()
+        export(df_styled, buffer)
+        return buffer.getvalue()
+
+
+def create_renderer(
+        backend: str, barrel_path: str, font: str = "", caption_font: str = "", encoding: Optional[EncodeOptions] = None
+) -> CardRenderer:
+    match backend:
+        case "pillow":
+            return PillowCardRenderer(barrel_path, font, caption_font, encoding)
+        case "dataframe":
+            return DataFrameCardRenderer(barrel_path, encoding)
+        case _:
+            raise ValueError(f"unknown render backend {backend}")
+
+
+# отрисовщик процесса из пула: создаётся один раз при запуске процесса, задачи передают только CardData
+_worker_renderer: Optional[CardRenderer] = None
+
+
+def init_render_worker(
+        backend: str, barrel_path: str, font: str, caption_font: str, encoding: EncodeOptions,
+        cards: dict[int, list[list[Optional[int]]]]
+):
+    global _worker_renderer
+    if hasattr(os, "nice"):
+        os.nice(10)  # процессор в первую очередь достаётся циклу событий бота
+    _worker_renderer = create_renderer(backend, barrel_path, font, caption_font, encoding)
+    _worker_renderer.warm_up(cards)
+
+
+def render_in_worker(card: CardData) -> bytes:
+    return _worker_renderer.to_bytes(card)
+
+
+def composite_in_worker(cards: list[CardData], columns: int) -> bytes:
+    return _worker_renderer.composite_to_bytes(cards, columns)
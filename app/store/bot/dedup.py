@@ -0,0 +1,67 @@
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from app.store.vk_api.dataclasses import Update
+
+
+class DedupWindow:
+    """Помнит недавно обработанные обновления каждой беседы, чтобы повторная доставка не выполнялась дважды.
+
+    Обновление определяется по conversation_message_id, а при его отсутствии - по event_id.
+    Беседа хранит не больше chat_size ключей не дольше ttl секунд, всего хранится не больше max_chats бесед:
+    при переполнении забывается беседа, в которую дольше всего ничего не приходило.
+    """
+
+    def __init__(self, ttl: float, chat_size: int, max_chats: int):
+        self.ttl = ttl
+        self.chat_size = chat_size
+        self.max_chats = max_chats
+        self.chats: OrderedDict[tuple[int, int], OrderedDict[int | str, float]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(update: Update) -> Optional[int | str]:
+        return update.object.message_id or update.event_id
+
+    def is_duplicate(self, update: Update) -> bool:
+        """Проверяет обновление и запоминает его, если оно встретилось впервые"""
+
+        key = self._key(update)
+        if key is None:
+            return False
+
+        chat_key = (update.group_id, update.object.peer_id)
+        chat = self.chats.get(chat_key)
+        if chat is None:
+            chat = self.chats[chat_key] = OrderedDict()
+            if len(self.chats) > self.max_chats:
+                self.chats.popitem(last=False)
+        else:
+            self.chats.move_to_end(chat_key)
+
+        now = time.monotonic()
+        while chat:
+            oldest_key, seen_at = next(iter(chat.items()))
+            if now - seen_at < self.ttl:
+                break
+            del chat[oldest_key]
+
+        if key in chat:
+            self.hits += 1
+            return True
+
+        self.misses += 1
+        chat[key] = now
+        if len(chat) > self.chat_size:
+            chat.popitem(last=False)
+        return False
+
+    def stats(self) -> dict:
+        return {
+            "chats": len(self.chats),
+            "keys": sum(len(chat) for chat in self.chats.values()),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
@@ -0,0 +1,119 @@
+import asyncio
+import time
+from asyncio import Task
+from collections import deque
+from dataclasses import dataclass, field
+from logging import getLogger
+from typing import Awaitable, Callable, Optional
+
+from app.store.bot.router import RoutedCommand
+from app.store.vk_api.dataclasses import Update
+
+Handler = Callable[[Update, Optional[RoutedCommand]], Awaitable[None]]
+
+
+@dataclass
+class ChatQueue:
+    updates: deque = field(default_factory=deque)
+    is_scheduled: bool = False
+    last_wait: float = 0.0
+    max_wait: float = 0.0
+
+
+class ChatDispatcher:
+    """Раскладывает обновления по очередям бесед и обрабатывает беседы параллельно.
+
+    Каждую беседу в любой момент времени обрабатывает не более одного воркера,
+    поэтому порядок сообщений внутри беседы сохраняется. Одновременно в очередях бесед и в обработке
+    находится не больше max_pending обновлений: места занимаются reserve и освобождаются release.
+    """
+
+    def __init__(self, handler: Handler, workers: int, max_pending: int):
+        self.handler = handler
+        self.workers_amount = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.has_room = asyncio.Event()
+        self.has_room.set()
+        self.logger = getLogger("dispatcher")
+        self.chats: dict[tuple[int, int], ChatQueue] = {}
+        self.ready: asyncio.Queue[tuple[int, int]] = asyncio.Queue()
+        self.workers: list[Task] = []
+        self.processed = 0
+        self.max_wait = 0.0
+
+    async def start(self):
+        self.workers = [asyncio.create_task(self._work()) for _ in range(self.workers_amount)]
+
+    async def stop(self):
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+
+    async def reserve(self, limit: int) -> int:
+        """Ждёт свободного места и занимает до limit мест; возвращает, сколько мест занято"""
+
+        while self.pending >= self.max_pending:
+            self.has_room.clear()
+            await self.has_room.wait()
+        amount = min(limit, self.max_pending - self.pending)
+        self.pending += amount
+        return amount
+
+    def release(self):
+        """Освобождает место, когда обновление обработано или отброшено"""
+
+        self.pending -= 1
+        self.has_room.set()
+
+    def submit(self, update: Update, routed: Optional[RoutedCommand] = None):
+        """Ставит обновление в очередь беседы вместе с уже распознанной командой, чтобы не разбирать текст заново"""
+
+        # у разных сообществ peer_id бесед пересекаются, поэтому ключ включает сообщество
+        chat_key = (update.group_id, update.object.peer_id)
+        chat = self.chats.setdefault(chat_key, ChatQueue())
+        chat.updates.append((update, routed, time.monotonic()))
+        if not chat.is_scheduled:
+            chat.is_scheduled = True
+            self.ready.put_nowait(chat_key)
+
+    async def _work(self):
+        while True:
+            chat_key = await self.ready.get()
+            chat = self.chats[chat_key]
+            update, routed, enqueued_at = chat.updates.popleft()
+            chat.last_wait = time.monotonic() - enqueued_at
+            chat.max_wait = max(chat.max_wait, chat.last_wait)
+            self.max_wait = max(self.max_wait, chat.last_wait)
+            try:
+                await self.handler(update, routed)
+            except Exception as e:
+                self.logger.exception("Update handling failed", exc_info=e)
+            update.mark_done()
+            self.processed += 1
+
+            if chat.updates:
+                self.ready.put_nowait(chat_key)
+            else:
+                chat.is_scheduled = False
+                del self.chats[chat_key]
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        return {
+            "workers": self.workers_amount,
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "ready_chats": self.ready.qsize(),
+            "processed": self.processed,
+            "max_wait": self.max_wait,
+            "chats": {
+                f"{group_id}:{peer_id}": {
+                    "depth": len(chat.updates),
+                    "oldest_wait": now - chat.updates[0][-1] if chat.updates else 0.0,
+                    "last_wait": chat.last_wait,
+                    "max_wait": chat.max_wait,
+                } for (group_id, peer_id), chat in self.chats.items()
+            },
+        }
@@ -1,86 +1,121 @@
+import asyncio
 import typing
-import enum
-import re
+from itertools import zip_longest
 from random import sample as rand_sample
+from typing import Optional
 from logging import getLogger
 
+from app.base.ttl_cache import TTLCache
 from app.store.vk_api.dataclasses import Message, Update
-from app.russian_loto.models import GameSession, SessionPlayer
+from app.store.vk_api.group import current_group_id
+from app.store.vk_api.scheduler import Priority
+from app.russian_loto.models import Player, SessionPlayer
+from app.store.bot.card_cache import CardDocCache
+from app.store.bot.dedup import DedupWindow
+from app.store.bot.dispatcher import ChatDispatcher
 from app.store.bot.picturbation import Picturbator
+from app.store.russian_loto.state import ChatKey
+from app.store.bot.router import CommandRouter, Commands, RoutedCommand
+from app.store.bot.throttle import CommandThrottle
 
 if typing.TYPE_CHECKING:
     from app.web.app import Application
 
 
 class BotManager:
-    CMDS_PATTERNS = {
-        "greetings": r"Привет!", "start_loto": r"([Нн]ачать) (лото)( [1|2])? ?!?",
-        "join_loto": r"\+", "fill_bag": r"([Зз]аполнить) (мешок|мешочек) ?!?",
-        "game_move": r"([Хх]од)( (10|[1-9]))? ?!?", "stop_loto": r"([Сс]топ) (лото) ?!?",
-    }
-
-    class Commands(enum.Enum):
-        nothing = 0b000000
-        greetings = 0b000001
-        start_loto = 0b000010
-        join_loto = 0b000100
-        fill_bag = 0b001000
-        pull_barrel = 0b010000
-        stop_loto = 0b100000
+    MEMBERS_ACTIONS = ("chat_invite_user", "chat_invite_user_by_link", "chat_kick_user")
 
     def __init__(self, app: "Application"):
         self.app = app
         self.bot = None
         self.logger = getLogger("handler")
         self.russian_loto = RussianLoto(app)
-        self.bot_mention = rf"(\[club{self.app.config.bot.group_id}\|[@]?[а-яА-Яa-zA-Z_0-9 ]+\][,]?)"
+        self.router = CommandRouter()
+        dispatcher_config = self.app.config.dispatcher
+        self.dispatcher = ChatDispatcher(self.handle_update, dispatcher_config.workers, dispatcher_config.max_pending)
+        dedup_config = self.app.config.dedup
+        self.dedup = DedupWindow(dedup_config.ttl, dedup_config.chat_size, dedup_config.max_chats)
+        throttle_config = self.app.config.throttle
+        self.throttle = CommandThrottle(throttle_config.rate, throttle_config.burst, throttle_config.max_keys)
+        app.on_startup.append(self.connect)
+        app.on_cleanup.append(self.disconnect)
+
+    async def connect(self, app: "Application"):
+        await self.dispatcher.start()
+
+    async def disconnect(self, app: "Application"):
+        await self.dispatcher.stop()
 
     async def handle_updates(self, updates: list[Update]):
         for update in updates:
-            match update.type:
-                case "message_new":
-                    await self.handle_new_message(update)
-                case "chat_invite_yasb":
-                    pass
+            # повторы после сетевых ошибок и перезапусков иначе выполнили бы команду ещё раз
+            if self.dedup.is_duplicate(update):
+                update.mark_done()
+                continue
+            if update.type == "message_new" and self.app.store.loto_state.is_handled(
+                    (update.group_id, update.object.peer_id), update.object.message_id
+            ):
+                # окно дублей после перезапуска пустое, а изменения команды могли попасть в базу раньше сохранения ts
+                update.mark_done()
+                continue
+            routed = None
+            if update.type == "message_new":
+                # флуд командами отсекается до очереди беседы, не доходя до базы и отрисовки карточек
+                routed = self.router.route(update.object.body, update.group_id)
+                if routed and not self.throttle.admit(self._throttle_key(update, routed.command)):
+                    update.mark_done()
+                    continue
+            self.dispatcher.submit(update, routed)
 
     @staticmethod
-    def _build_cmd_flag(bot_mention: str, command: str, source: str) -> int:
-        pattern = rf"({bot_mention} )?{command}"
-        flag = int(re.fullmatch(pattern, source) is not None)
-        return flag
-
-    async def handle_new_message(self, update: Update):
-        msg = update.object.body
-        command_flags = self.Commands(sum([
-            self._build_cmd_flag(self.bot_mention, cmd, msg) << i for i, cmd in enumerate(self.CMDS_PATTERNS.values())
-        ]))
+    def _throttle_key(update: Update, command: Commands) -> tuple[int, int, int, Commands]:
+        return update.group_id, update.object.peer_id, update.object.user_id, command
+
+    async def handle_update(self, update: Update, routed: Optional[RoutedCommand]):
+        current_group_id.set(update.group_id)
+        if update.object.action in self.MEMBERS_ACTIONS:
+            self.app.store.vk_api.invalidate_chat_members(update.object.peer_id)
+
+        match update.type:
+            case "message_new":
+                await self.handle_new_message(update, routed)
+            case "chat_invite_yasb":
+                pass
+
+    async def handle_new_message(self, update: Update, routed: Optional[RoutedCommand]):
+        if routed is None:
+            return
+
         user_id = update.object.user_id
         peer_id = update.object.peer_id
         message_id = update.object.message_id
-        match command_flags:
-            case self.Commands.greetings:
-                await self.app.store.vk_api.send_message(Message(user_id=user_id, text="Привет!"), peer_id)
-            case self.Commands.start_loto:
-                game_type = re.sub("\D", "", msg)
-                game_type = game_type if game_type else "1"
-                if user_id != peer_id:
-                    await self.russian_loto.start_session(user_id, peer_id, game_type)
-            case self.Commands.join_loto:
-                if user_id != peer_id:
-                    await self.russian_loto.add_players(user_id, peer_id, message_id)
-            case self.Commands.fill_bag:
-                if user_id != peer_id:
-                    await self.russian_loto.fill_bag(user_id, peer_id, message_id)
-            case self.Commands.pull_barrel:
-                amount = re.sub("\D", "", msg)
-                amount = amount if amount else "10"
-                if user_id != peer_id:
-                    await self.russian_loto.lead_move(user_id, peer_id, int(amount))
-            case self.Commands.stop_loto:
-                if user_id != peer_id:
-                    await self.russian_loto.close_session(user_id, peer_id)
-            case _:
-                pass
+        try:
+            match routed.command:
+                case Commands.greetings:
+                    await self.app.store.vk_api.send_message(Message(user_id=user_id, text="Привет!"), peer_id)
+                case Commands.start_loto:
+                    if user_id != peer_id:
+                        await self.russian_loto.start_session(user_id, peer_id, routed.game_type)
+                case Commands.join_loto:
+                    if user_id != peer_id:
+                        await self.russian_loto.add_players(user_id, peer_id, message_id)
+                case Commands.fill_bag:
+                    if user_id != peer_id:
+                        await self.russian_loto.fill_bag(user_id, peer_id, message_id)
+                case Commands.pull_barrel:
+                    if user_id != peer_id:
+                        await self.russian_loto.lead_move(user_id, peer_id, routed.barrels_amount)
+                case Commands.stop_loto:
+                    if user_id != peer_id:
+                        await self.russian_loto.close_session(user_id, peer_id)
+                case Commands.card_mode:
+                    if user_id != peer_id:
+                        await self.russian_loto.set_card_mode(user_id, peer_id, routed.card_mode)
+                case _:
+                    pass
+        finally:
+            self.throttle.release(self._throttle_key(update, routed.command))
+            self.app.store.loto_state.mark_handled((update.group_id, peer_id), message_id)
 
 
 class RussianLoto:
@@ -89,18 +124,29 @@ class RussianLoto:
     ROW_NUMBERS_AMOUNT = 5
     ROWS_AMOUNT = 3
     NUMERIC_CELLS_AMOUNT = ROW_NUMBERS_AMOUNT * ROWS_AMOUNT
+    MESSAGE_LENGTH = 4096
+    ATTACHMENTS_LIMIT = 10  # вложений в одном сообщении VK
+    CARDS_SEPARATOR = "%0A%0A"
 
     def __init__(self, app: "Application"):
         self.app = app
         self.picturbator = Picturbator(app)
+        render_config = self.app.config.render
+        self.card_docs = CardDocCache(render_config.cache_ttl, render_config.cache_sessions)
+        # выбранный в беседе вид карточек, text или images: сбрасывается в конце игры, как и загруженные карточки
+        self.card_modes = TTLCache(render_config.cache_ttl, render_config.cache_sessions)
         self.logger = getLogger("Russian Loto")
 
+    def _chat_key(self, peer_id: int) -> ChatKey:
+        return self.app.store.vk_api.group.id, peer_id
+
     async def start_session(self, lead_id, peer_id, game_type):
-        session_id = await self.app.store.loto_games.create_new_session(peer_id, game_type)
+        key = self._chat_key(peer_id)
+        session_id = self.app.store.loto_state.create_session(key, game_type)
         game_type_msg = "быстрая" if game_type == "2" else "простая"
         if session_id:
-            await self.app.store.loto_games.add_lead_to_session(session_id, lead_id)
-            await self.app.store.loto_games.set_session_status(peer_id, "adding players")
+            await self.app.store.loto_state.add_lead(key, lead_id)
+            self.app.store.loto_state.set_session_status(key, "adding players")
             msg = f"Игра начата! Тип игры: {game_type_msg}. Чтобы играть, отправьте \"%2B\". " \
                   f"После того, как игроки будут набраны, ведущий сможет заполнить мешок бочонками командой " \
                   f"\"Заполнить мешок!\"."
@@ -109,78 +155,87 @@ class RussianLoto:
         await self.app.store.vk_api.send_message(Message(user_id=lead_id, text=msg), peer_id)
 
     async def add_players(self, player_id, peer_id, message_id):
-        session: GameSession = await self.app.store.loto_games.get_session_by_chat_id(peer_id)
-        if session and session.status == "adding players":
-            card_number = await self.app.store.loto_games.get_random_free_card(session.chat_id)
+        key = self._chat_key(peer_id)
+        state = self.app.store.loto_state.get(key)
+        if state and state.session.status == "adding players":
+            card_number = self.app.store.loto_state.get_random_free_card(key)
             if card_number:
-                await self.app.store.loto_games.add_player_to_session(session.chat_id, player_id, card_number)
-                player_card = await self.app.store.loto_games.add_player_card(session.chat_id, player_id, card_number)
+                player_card = await self.app.store.loto_state.add_player(key, player_id, card_number)
                 if player_card:
-                    doc_path = await self.picturbator.generate_card_picture(card_number, player_card)
-                    doc_ref = await self.app.store.vk_api.post_doc(doc_path)
-                    while not doc_ref:
-                        doc_ref = await self.app.store.vk_api.post_doc(doc_path)
+                    player, session_player = state.profiles[player_id], state.players[player_id]
                     msg = f"Вы участвуете. Номер вашей карты - {card_number}."
+                    if self._text_cards(key):
+                        card_text, = self.picturbator.generate_card_texts([(session_player, player, player_card)])
+                        msg += self.CARDS_SEPARATOR + card_text
+                        doc_ref = ""
+                    else:
+                        picture = await self.picturbator.generate_card_picture(session_player, player, player_card)
+                        doc_ref, = await self.app.store.vk_api.post_docs([picture])
+                        self.card_docs.count(rendered=1, uploaded=int(bool(doc_ref)))
+                        self.card_docs.set(
+                            key, (card_number, player_id), self.card_docs.coverage_mask(player_card), doc_ref
+                        )
                     await self.app.store.vk_api.send_message(
                         Message(user_id=player_id, text=msg), peer_id, message_id, doc_ref
                     )
-                    # await self.picturbator.delete_card_picture(doc_path)
             else:
                 msg = f"Вы не можете участвовать, поскольку в игре может быть до {self.app.cards.cards_amount} карт."
                 await self.app.store.vk_api.send_message(Message(user_id=player_id, text=msg), peer_id, message_id)
 
     async def fill_bag(self, user_id, peer_id, message_id):
-        players = await self.app.store.loto_games.get_session_players(peer_id)
-        lead = await self.app.store.loto_games.get_session_leader(peer_id)
+        key = self._chat_key(peer_id)
+        state = self.app.store.loto_state.get(key)
+        lead = state.lead if state else None
         if not lead:
             return
 
-        if len(players) >= self.MIN_PLAYERS_AMOUNT and lead.player_id == user_id:
-            await self.app.store.loto_games.set_session_status(peer_id, "filling bag")
-            filled = await self.app.store.loto_games.add_barrels_to_session(peer_id)
+        if len(state.card_players) >= self.MIN_PLAYERS_AMOUNT and lead.player_id == user_id:
+            self.app.store.loto_state.set_session_status(key, "filling bag")
+            filled = self.app.store.loto_state.add_barrels_to_session(key)
             if filled:
                 await self.app.store.vk_api.send_message(Message(
                     user_id=user_id,
                     text="Мешок заполнен! С этого момента ведущий вытаскивает из мешка бочонки сообщением \"Ход!\"."
                 ), peer_id)
-                await self.app.store.loto_games.set_session_status(peer_id, "handling moves")
+                self.app.store.loto_state.set_session_status(key, "handling moves")
         elif lead.player_id == user_id:
             msg = f"Для игры необходимо минимум 2 игрока. Пожалуйста, соберите команду. " \
                   f"Для участия игроки отправляют \"%2B\"."
             await self.app.store.vk_api.send_message(Message(user_id=user_id, text=msg), peer_id, message_id)
 
     async def lead_move(self, user_id, peer_id, barrels_amount):
-        session, session_lead = await self.app.store.loto_games.get_session_and_lead(peer_id)
+        # ход целиком читает и меняет состояние в памяти, в базу изменения уходят фоном
+        key = self._chat_key(peer_id)
+        state = self.app.store.loto_state.get(key)
+        session, session_lead = (state.session, state.lead) if state else (None, None)
         if not (session and session_lead):
             return
         if session.status != "handling moves" or session_lead.player_id != user_id:
             return
 
         game_type = session.type
-        barrels = await self.app.store.loto_games.get_barrels_by_bag_id(session_lead.session_id)
-
-        barrel_nums = [barrel.barrel_number for barrel in barrels]
-        barrels_amount = len(barrel_nums) if barrels_amount > len(barrel_nums) else barrels_amount
-        picked_barrel_nums = rand_sample(barrel_nums, barrels_amount)
-        await self.app.store.loto_games.pull_barrels_from_bag(session_lead.session_id, picked_barrel_nums)
-        await self.app.store.loto_games.cover_card_cells(session_lead.session_id, picked_barrel_nums)
+        barrels = sorted(state.bag)
 
-        card_cells = await self.app.store.loto_games.get_card_cells_from_session(session_lead.session_id)
-        players = await self.app.store.loto_games.get_session_players(session_lead.session_id)
+        barrels_amount = len(barrels) if barrels_amount > len(barrels) else barrels_amount
+        picked_barrel_nums = rand_sample(barrels, barrels_amount)
+        self.app.store.loto_state.pull_barrels(key, picked_barrel_nums)
 
+        players = state.card_players
         players_cards = [
-            (player, list(filter(lambda card_cell: card_cell.player_id == player.player_id, card_cells)))
-            for player in players
+            (player, state.profiles[player.player_id], state.cards[player.player_id]) for player in players
         ]
         players_ids_stats = {player.player_id: False for player in players}
 
-        doc_refs = []
-        for player, card in players_cards:
-            doc_path = await self.picturbator.generate_card_picture(player.card_number, card)
-            doc_ref = await self.app.store.vk_api.post_doc(doc_path)
-            while not doc_ref:
-                doc_ref = await self.app.store.vk_api.post_doc(doc_path)
-            doc_refs.append(doc_ref)
+        card_texts = []
+        if self._text_cards(key):
+            # ни отрисовки, ни загрузок: ход отвечается сразу, пока отрисовка или VK не справляются
+            card_texts = self.picturbator.generate_card_texts(players_cards)
+            doc_refs = []
+        elif self.picturbator.composite:
+            doc_refs = await self._post_composite_cards(key, players_cards)
+        else:
+            doc_refs = await self._post_cards(key, players_cards)
+        for player, _, card in players_cards:
             match game_type:
                 case "simple":
                     covered_cells = list(filter(lambda card_cell: card_cell.is_covered is True, card))
@@ -197,16 +252,16 @@ class RussianLoto:
 
         barrels_nums = ", ".join(list(map(str, picked_barrel_nums)))
         if len(barrels) == barrels_amount or True in players_ids_stats.values():  # last step or win
-            await self.app.store.loto_games.set_session_status(session.chat_id, "summing up")
+            self.app.store.loto_state.set_session_status(key, "summing up")
             winners_ids = [player_id for player_id, stat in players_ids_stats.items() if stat is True]
             players_ids = [player_id for player_id, stat in players_ids_stats.items() if stat is False]
-            await self.app.store.loto_games.set_players_status(winners_ids, played=True, won=True)
-            await self.app.store.loto_games.set_players_status(players_ids, played=True)
-            await self.app.store.loto_games.set_players_status([session_lead.player_id], lead=True)
+            self.app.store.loto_state.set_players_status(key, winners_ids, played=True, won=True)
+            self.app.store.loto_state.set_players_status(key, players_ids, played=True)
+            self.app.store.loto_state.set_players_status(key, [session_lead.player_id], lead=True)
 
-            lead_upd = (await self.app.store.loto_games.get_players_by_ids([session_lead.player_id]))[0]
-            winners_upd = await self.app.store.loto_games.get_players_by_ids(winners_ids)
-            players_upd = await self.app.store.loto_games.get_players_by_ids(players_ids)
+            lead_upd = state.profiles[session_lead.player_id]
+            winners_upd = [state.profiles[player_id] for player_id in winners_ids]
+            players_upd = [state.profiles[player_id] for player_id in players_ids]
             winners_str = ", ".join([f"[id{winner.id}|{winner.name}]" for winner in winners_upd])
             players_stats = "%0A".join([
                                 f"- [id{winner_upd.id}|{winner_upd.name}] - сыграно раз: {winner_upd.times_played}, "
@@ -229,28 +284,110 @@ class RussianLoto:
                 msg = f"Игра окончена! Тип игры: {game_type}.%0A- номера за этот ход: {barrels_nums}.%0A" \
                       f"- ведущий игры: [id{lead_upd.id}|{lead_upd.name}]." \
                       f"%0AСтатистика игроков:%0A{players_stats}"
-            await self.app.store.loto_games.delete_session(session_lead.session_id)
+            self._end_session(key)
+            priority = Priority.stats
         else:
             msg = f"Номера за этот ход: {barrels_nums}.%0AБочонков осталось: {len(barrels) - barrels_amount}."
+            priority = Priority.game
+
+        doc_refs = list(filter(None, doc_refs))
+        attachments = [
+            ",".join(doc_refs[k:k + self.ATTACHMENTS_LIMIT]) for k in range(0, len(doc_refs), self.ATTACHMENTS_LIMIT)
+        ]
+        # не поместившиеся в первое сообщение карточки уходят следующими сообщениями без текста
+        for text, attachment in zip_longest(self._with_card_texts(msg, card_texts), attachments, fillvalue=""):
+            await self.app.store.vk_api.send_message(
+                Message(user_id=session_lead.player_id, text=text), session.chat_id, attachment=attachment,
+                disable_mentions=True, priority=priority
+            )
+
+    def _text_cards(self, key: ChatKey) -> bool:
+        default_mode = "text" if self.picturbator.config.layout == "text" else "images"
+        return (self.card_modes.get(key) or default_mode) == "text" or self.picturbator.overloaded()
+
+    @classmethod
+    def _with_card_texts(cls, msg: str, card_texts: list[str]) -> list[str]:
+        """Дописывает карточки к сообщению, а не поместившиеся в лимит длины VK - в следующие сообщения"""
+
+        messages = [msg]
+        for card_text in card_texts:
+            if len(messages[-1]) + len(cls.CARDS_SEPARATOR) + len(card_text) > cls.MESSAGE_LENGTH:
+                messages.append(card_text)
+            else:
+                messages[-1] += cls.CARDS_SEPARATOR + card_text
+        return messages
 
-        attachment = ",".join(doc_refs)
-        await self.app.store.vk_api.send_message(
-            Message(user_id=session_lead.player_id, text=msg), session.chat_id, attachment=attachment,
-            disable_mentions=True
+    async def set_card_mode(self, user_id, peer_id, card_mode: str):
+        self.card_modes.set(self._chat_key(peer_id), card_mode)
+        msg = "Карточки будут приходить текстом." if card_mode == "text" else \
+            "Карточки будут приходить картинками. Если бот перегружен, они всё равно придут текстом."
+        await self.app.store.vk_api.send_message(Message(user_id=user_id, text=msg), peer_id)
+
+    async def _post_cards(
+            self, session_key: ChatKey, players_cards: list[tuple[SessionPlayer, Player, list]]
+    ) -> list[str]:
+        # карточки, на которых за ход ничего не закрылось, не перерисовываются и не загружаются заново
+        keys = [(player.card_number, player.player_id) for player, _, _ in players_cards]
+        masks = [self.card_docs.coverage_mask(card) for _, _, card in players_cards]
+        doc_refs = [self.card_docs.get(session_key, key, mask) for key, mask in zip(keys, masks)]
+        changed = [k for k, doc_ref in enumerate(doc_refs) if doc_ref is None]
+        pictures = await asyncio.gather(*[
+            self.picturbator.generate_card_picture(*players_cards[k]) for k in changed
+        ])
+        for k, doc_ref in zip(changed, await self.app.store.vk_api.post_docs(pictures)):
+            self.card_docs.set(session_key, keys[k], masks[k], doc_ref)
+            doc_refs[k] = doc_ref
+        self.card_docs.count(
+            reused=len(doc_refs) - len(changed), rendered=len(changed),
+            uploaded=sum(1 for k in changed if doc_refs[k])
+        )
+        return doc_refs
+
+    async def _post_composite_cards(
+            self, session_key: ChatKey, players_cards: list[tuple[SessionPlayer, Player, list]]
+    ) -> list[str]:
+        """Загружает карточки всех игроков общими изображениями, по composite_size карточек в каждом"""
+
+        size = self.picturbator.config.composite_size
+        chunks = [players_cards[k:k + size] for k in range(0, len(players_cards), size)]
+        keys = [("composite", k) for k in range(len(chunks))]
+        masks = [
+            tuple((player.player_id, self.card_docs.coverage_mask(card)) for player, _, card in chunk)
+            for chunk in chunks
+        ]
+        doc_refs = [self.card_docs.get(session_key, key, mask) for key, mask in zip(keys, masks)]
+        changed = [k for k, doc_ref in enumerate(doc_refs) if doc_ref is None]
+        pictures = await asyncio.gather(*[
+            self.picturbator.generate_composite_picture(chunks[k]) for k in changed
+        ])
+        for k, doc_ref in zip(changed, await self.app.store.vk_api.post_docs(pictures)):
+            self.card_docs.set(session_key, keys[k], masks[k], doc_ref)
+            doc_refs[k] = doc_ref
+        rendered = sum(len(chunks[k]) for k in changed)
+        self.card_docs.count(
+            reused=len(players_cards) - rendered, rendered=rendered,
+            uploaded=sum(len(chunks[k]) for k in changed if doc_refs[k])
         )
+        return doc_refs
+
+    def _end_session(self, key: ChatKey):
+        self.app.store.loto_state.delete_session(key)
+        self.card_docs.evict(key)
+        self.card_modes.invalidate(key)
 
     async def close_session(self, user_id, peer_id):
-        leader: SessionPlayer = await self.app.store.loto_games.get_session_leader(peer_id)
+        key = self._chat_key(peer_id)
+        state = self.app.store.loto_state.get(key)
+        leader: SessionPlayer = state.lead if state else None
         if not leader:
             return
 
         if leader.player_id == user_id:
-            await self.app.store.loto_games.delete_session(leader.session_id)
+            self._end_session(key)
             await self.app.store.vk_api.send_message(Message(user_id=user_id, text="Игра окончена досрочно!"), peer_id)
         else:
-            player_data = await self.app.store.vk_api.get_chat_user(leader.session_id, user_id)
-            if player_data["is_admin"]:
-                await self.app.store.loto_games.delete_session(leader.session_id)
+            if await self.app.store.vk_api.is_chat_admin(peer_id, user_id):
+                self._end_session(key)
                 await self.app.store.vk_api.send_message(Message(
                     user_id=user_id, text="Игра окончена досрочно!"
                 ), peer_id)
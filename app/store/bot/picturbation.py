@@ -1,99 +1,141 @@
-from pandas import DataFrame
-from dataframe_image import export
+import asyncio
 import os
 import sys
 import typing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional
 
 from logging import getLogger
 
-from app.russian_loto.models import CardCell
+from app.russian_loto.models import CardCell, Player, SessionPlayer
+from app.store.bot.card_renderer import (
+    CardData, EncodeOptions, card_to_text, composite_in_worker, create_renderer, init_render_worker, render_in_worker
+)
 
 if typing.TYPE_CHECKING:
     from app.web.app import Application
 
 
 class Picturbator:
-    RED = '#E20D13'
-    SHIFT_I = 1
-    SHIFT_J = 2
-    TABLE_STYLES = [
-        {
-            'selector': 'th', 'props': 'text-align: center; background-color: white;'
-        },
-        {
-            'selector': 'th:nth-child(1)', 'props': 'border-top: 1px solid white;'
-        },
-        {
-            'selector': 'td', 'props': [
-                ('font-size', '24pt'), ('font-weight', 'bold'), ('border', '1px solid black'),
-                ('text-align', 'center'), ('width', '44px'), ('border-color', 'black')
-            ]
-        },
-        {
-            'selector': 'caption', 'props': [
-                ('text-align', 'left'), ('font-size', '12pt'), ('font-weight', 'normal'), ('font-style', 'italic')
-            ]
-        }
-    ]
     MAIN_DIR = os.path.dirname(sys.modules["__main__"].__file__)
     BARREL_IMG_PATH = os.path.join(MAIN_DIR, "images/barrel.png").replace("\\", "/")
-    COLUMNS = ["1", "2", "3", "4", "5", "6", "7", "8", "9"]
-    INDEXES = ["1", "2", "3"]
+    ROWS_AMOUNT = 3
 
     def __init__(self, app: "Application"):
         self.app = app
         self.logger = getLogger("handler")
+        self.config = self.app.config.render
+        self.encoding = EncodeOptions(
+            palette=self.config.png_palette, compress_level=self.config.png_compress_level,
+            optimize=self.config.png_optimize, scale=self.config.scale
+        )
+        self.renderer = create_renderer(
+            self.config.backend, self.BARREL_IMG_PATH, self.config.font, self.config.caption_font, self.encoding
+        )
+        self.executor: Optional[Executor] = None
+        self.to_bytes = self.renderer.to_bytes
+        self.composite_to_bytes = self.renderer.composite_to_bytes
+        self.pending = 0  # карточек в очереди отрисовки
+        self.text_cards = 0  # карточек, отправленных текстом
+        app.on_startup.append(self.connect)
+        app.on_cleanup.append(self.disconnect)
+
+    def _cards(self) -> dict[int, list[list[Optional[int]]]]:
+        return {
+            card_number: [card.r_1, card.r_2, card.r_3]
+            for card_number, card in enumerate(self.app.cards.cards, start=1)
+        }
 
-    async def generate_card_picture(self, card_number, card: list[CardCell]) -> str:
-        """По данным о переданной карте формирует изображение и возвращает путь к файлу"""
-
-        card_numbers = [
-            [
-                str(card.barrel_number) if card.barrel_number else ""
-                for card in list(filter(lambda card_cell: card_cell.row_index == 1, card))
-            ],
-            [
-                str(card.barrel_number) if card.barrel_number else ""
-                for card in list(filter(lambda card_cell: card_cell.row_index == 2, card))
-            ],
-            [
-                str(card.barrel_number) if card.barrel_number else ""
-                for card in list(filter(lambda card_cell: card_cell.row_index == 3, card))
-            ]
-        ]
-        card_barrels = [
-            [card.is_covered for card in list(filter(lambda card_cell: card_cell.row_index == 1, card))],
-            [card.is_covered for card in list(filter(lambda card_cell: card_cell.row_index == 2, card))],
-            [card.is_covered for card in list(filter(lambda card_cell: card_cell.row_index == 3, card))]
+    async def connect(self, app: "Application"):
+        # отрисовка - синхронная работа процессора, поэтому она выносится из цикла событий
+        cards = self._cards()
+        match self.config.executor:
+            case "process":
+                # процессы пула сами готовят шаблоны при запуске, им передаются только данные карточек
+                self.executor = ProcessPoolExecutor(self.config.workers, initializer=init_render_worker, initargs=(
+                    self.config.backend, self.BARREL_IMG_PATH, self.config.font, self.config.caption_font,
+                    self.encoding, cards
+                ))
+                self.to_bytes = render_in_worker
+                self.composite_to_bytes = composite_in_worker
+                # процессы запускаются сразу, а не на первом ходе
+                loop = asyncio.get_running_loop()
+                await asyncio.gather(*[loop.run_in_executor(self.executor, int) for _ in range(self.config.workers)])
+                return
+            case "thread":
+                self.executor = ThreadPoolExecutor(self.config.workers, thread_name_prefix="render")
+        # шаблоны карточек готовятся до первых событий, чтобы первый ход не платил за их отрисовку
+        self.renderer.warm_up(cards)
+
+    async def disconnect(self, app: "Application"):
+        if self.executor:
+            await asyncio.get_running_loop().run_in_executor(None, self.executor.shutdown)
+            self.executor = None
+
+    @property
+    def composite(self) -> bool:
+        return self.config.layout == "composite"
+
+    def overloaded(self) -> bool:
+        """Отрисовка или загрузка карточек отстают настолько, что их лучше отправить текстом"""
+
+        if self.config.text_render_queue and self.pending >= self.config.text_render_queue:
+            return True
+        if self.config.text_upload_latency:
+            latency = self.app.store.vk_api.recent_upload_latency(self.config.text_latency_window)
+            return latency >= self.config.text_upload_latency
+        return False
+
+    def stats(self) -> dict:
+        return {"pending": self.pending, "text_cards": self.text_cards}
+
+    def _card_data(self, session_player: SessionPlayer, player: Player, card: list[CardCell]) -> CardData:
+        # все данные для подписи приходят от вызывающего: отрисовка не обращается к базе
+        rows = [
+            list(filter(lambda card_cell: card_cell.row_index == i, card)) for i in range(1, self.ROWS_AMOUNT + 1)
         ]
+        player_role = "Ведущий, игрок" if session_player.role == "leadplayer" else "Игрок"
+        return CardData(
+            number=session_player.card_number,
+            numbers=[[card_cell.barrel_number for card_cell in row] for row in rows],
+            covered=[[card_cell.is_covered for card_cell in row] for row in rows],
+            caption=[f"Карта №{session_player.card_number}", f"{player_role} - {player.name}"],
+        )
 
-        t_styles = self.TABLE_STYLES.copy()
-        df = DataFrame(card_numbers, columns=self.COLUMNS, index=self.INDEXES)
-        for i, row in enumerate(card_numbers):
-            for j, cell in enumerate(row):
-                props = [
-                    ('background-repeat', 'no-repeat'), ('background-position', 'center'),
-                    ('background-size', '64px 64px'),
-                    ('background-image', f'url("{self.BARREL_IMG_PATH}")'), ('color', self.RED)
-                ] if (card_numbers[i][j] and card_barrels[i][j] is True) else []
-
-                t_styles.append(
-                    {'selector': f'tr:nth-child({i + self.SHIFT_I}) td:nth-child({j + self.SHIFT_J})', 'props': props})
+    async def _run(self, cards_amount: int, render, *args) -> bytes:
+        if self.executor is None:
+            return render(*args)
+        self.pending += cards_amount
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, render, *args)
+        finally:
+            self.pending -= cards_amount
+
+    def _dump(self, name_parts: list, picture: bytes):
+        unique_pic_name = "_".join(["doc", *map(str, name_parts)])
+        pic_path = os.path.join(self.MAIN_DIR, f"images/{unique_pic_name}.png").replace("\\", "/")
+        with open(pic_path, "wb") as f:
+            f.write(picture)
 
-        df_styled = df.style.set_table_styles(t_styles)
+    async def generate_card_picture(self, session_player: SessionPlayer, player: Player, card: list[CardCell]) -> bytes:
+        """По данным о переданной карте формирует PNG изображение в памяти"""
 
-        player, session_player = await self.app.store.loto_games.get_session_and_player(
-            card[0].session_id, card[0].player_id
-        )
+        picture = await self._run(1, self.to_bytes, self._card_data(session_player, player, card))
+        if self.config.dump_files:
+            self._dump([session_player.session_id, session_player.player_id], picture)
+        return picture
 
-        player_role = "Ведущий, игрок" if session_player.role == "leadplayer" else "Игрок"
-        df_styled.set_caption(f'Карта №{card_number}<br>{player_role} - {player.name}')
+    async def generate_composite_picture(self, cards: list[tuple[SessionPlayer, Player, list[CardCell]]]) -> bytes:
+        """Собирает карточки нескольких игроков в одно PNG изображение в памяти"""
 
-        unique_pic_name = "_".join(["doc", str(session_player.session_id), str(session_player.player_id)])
-        pic_path = os.path.join(self.MAIN_DIR, f"images/{unique_pic_name}.png").replace("\\", "/")
-        export(df_styled, pic_path)
+        cards_data = [self._card_data(session_player, player, card) for session_player, player, card in cards]
+        picture = await self._run(len(cards_data), self.composite_to_bytes, cards_data, self.config.composite_columns)
+        if self.config.dump_files:
+            self._dump([cards[0][0].session_id, "composite", cards[0][0].card_number], picture)
+        return picture
 
-        return pic_path
+    def generate_card_texts(self, cards: list[tuple[SessionPlayer, Player, list[CardCell]]]) -> list[str]:
+        """Карточки текстом для отправки прямо в сообщении, без отрисовки и загрузки"""
 
-    async def delete_card_picture(self, card_path):
-        os.remove(card_path)
+        self.text_cards += len(cards)
+        return [card_to_text(self._card_data(session_player, player, card)) for session_player, player, card in cards]
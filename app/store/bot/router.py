@@ -0,0 +1,61 @@
+import enum
+import re
+from dataclasses import dataclass
+from typing import Optional
+
+
+class Commands(enum.Enum):
+    nothing = 0
+    greetings = 1
+    start_loto = 2
+    join_loto = 3
+    fill_bag = 4
+    pull_barrel = 5
+    stop_loto = 6
+    card_mode = 7
+
+
+@dataclass
+class RoutedCommand:
+    command: Commands
+    game_type: str = "1"
+    barrels_amount: int = 10
+    card_mode: str = ""
+
+
+class CommandRouter:
+    CMDS_PATTERNS = {
+        Commands.greetings: r"Привет!",
+        Commands.start_loto: r"[Нн]ачать лото(?: (?P<game_type>[12]))? ?!?",
+        Commands.join_loto: r"\+",
+        Commands.fill_bag: r"[Зз]аполнить (?:мешок|мешочек) ?!?",
+        Commands.pull_barrel: r"[Хх]од(?: (?P<barrels_amount>10|[1-9]))? ?!?",
+        Commands.stop_loto: r"[Сс]топ лото ?!?",
+        Commands.card_mode: r"[Кк]арточки (?P<mode>текстом|картинками) ?!?",
+    }
+
+    def __init__(self):
+        bot_mention = r"\[club(?P<club>\d+)\|@?[а-яА-Яa-zA-Z_0-9 ]+\],?"
+        commands = "|".join(
+            f"(?P<{command.name}>{pattern})" for command, pattern in self.CMDS_PATTERNS.items()
+        )
+        self.pattern = re.compile(rf"(?:{bot_mention} )?(?:{commands})")
+
+    def route(self, text: str, group_id: int) -> Optional[RoutedCommand]:
+        """Классифицирует сообщение за один проход и возвращает команду вместе с её аргументами.
+
+        Команда с упоминанием другого сообщества - не команда этого сообщества, даже если бот обслуживает оба.
+        """
+
+        match = self.pattern.fullmatch(text)
+        if match is None or match["club"] and int(match["club"]) != group_id:
+            return None
+
+        routed = RoutedCommand(command=Commands[match.lastgroup])
+        if match["game_type"]:
+            routed.game_type = match["game_type"]
+        if match["barrels_amount"]:
+            routed.barrels_amount = int(match["barrels_amount"])
+        if match["mode"]:
+            routed.card_mode = "text" if match["mode"] == "текстом" else "images"
+        return routed
@@ -0,0 +1,50 @@
+from typing import Hashable
+
+from app.base.token_bucket import TokenBucket
+from app.base.ttl_cache import TTLCache
+
+
+class CommandThrottle:
+    """Ограничивает частоту одной и той же команды от одного пользователя в одной беседе.
+
+    На каждый ключ заводится ведро токенов; пока команда по ключу стоит в очереди или выполняется,
+    её повторы отбрасываются. Ведро, которое успело бы заполниться целиком, забывается.
+    """
+
+    def __init__(self, rate: float, burst: float, max_keys: int):
+        self.rate = rate
+        self.burst = burst
+        self.buckets = TTLCache(burst / rate, max_keys)
+        self.in_flight: set[Hashable] = set()
+        self.admitted = 0
+        self.throttled = 0
+        self.coalesced = 0
+
+    def admit(self, key: Hashable) -> bool:
+        if key in self.in_flight:
+            self.coalesced += 1
+            return False
+
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(self.rate, self.burst)
+        self.buckets.set(key, bucket)
+        if not bucket.try_acquire():
+            self.throttled += 1
+            return False
+
+        self.in_flight.add(key)
+        self.admitted += 1
+        return True
+
+    def release(self, key: Hashable):
+        self.in_flight.discard(key)
+
+    def stats(self) -> dict:
+        return {
+            "keys": len(self.buckets.items),
+            "in_flight": len(self.in_flight),
+            "admitted": self.admitted,
+            "throttled": self.throttled,
+            "coalesced": self.coalesced,
+        }
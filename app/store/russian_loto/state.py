@@ -0,0 +1,412 @@
+import asyncio
+import typing
+from asyncio import Task
+from dataclasses import dataclass, field
+from datetime import datetime
+from random import choice
+from typing import Optional
+
+from sqlalchemy import select, update, delete, and_
+from sqlalchemy.dialects.mysql import insert
+from sqlalchemy.exc import InterfaceError, OperationalError, SQLAlchemyError
+from sqlalchemy.sql import Executable
+from sqlalchemy.sql.functions import func
+
+from app.base.base_accessor import BaseAccessor
+from app.bot.models import HandledMessageModel
+from app.russian_loto.models import *
+
+if typing.TYPE_CHECKING:
+    from app.web.app import Application
+
+# (group_id, peer_id): peer_id бесед нумеруются в каждом сообществе отдельно
+ChatKey = tuple[int, int]
+
+
+@dataclass
+class SessionState:
+    session: GameSession
+    players: dict[int, SessionPlayer] = field(default_factory=dict)  # вместе с ведущим
+    profiles: dict[int, Player] = field(default_factory=dict)
+    cards: dict[int, list[CardCell]] = field(default_factory=dict)
+    bag: Optional[set[int]] = None  # None - мешок ещё не заполнен
+
+    @property
+    def lead(self) -> Optional[SessionPlayer]:
+        return next((player for player in self.players.values() if player.role in ("lead", "leadplayer")), None)
+
+    @property
+    def card_players(self) -> list[SessionPlayer]:
+        return [player for player in self.players.values() if player.role in ("leadplayer", "player")]
+
+
+class GameStateEngine(BaseAccessor):
+    """Состояние идущих игр в памяти процесса: сессии, роли, карточки и мешки.
+
+    Чтение идёт только из памяти, а изменения копятся запросами и записываются в базу фоновой задачей
+    пачками в одной транзакции, поэтому ход не ждёт базу. При запуске состояние восстанавливается из базы.
+    """
+
+    INDEX_OFFSET = 1
+    BARRELS_AMOUNT = 90
+
+    def __init__(self, app: "Application", *args, **kwargs):
+        super().__init__(app, *args, **kwargs)
+        self.config = self.app.config.game_state
+        self.sessions: dict[ChatKey, SessionState] = {}
+        self.writes: list[Executable] = []
+        # профили, изменения которых ещё в очереди: в базе они пока устаревшие
+        self.unsaved_profiles: dict[int, Player] = {}
+        # профили, собранные без базы: статистика в них неизвестна и перечитывается после успешной записи
+        self.stale_profiles: dict[int, Player] = {}
+        # последняя выполненная команда беседы: пишется в базу вместе с её изменениями, поэтому после перезапуска
+        # команды, которые снова пришли из long poll, но уже есть в базе, не выполняются повторно
+        self.handled: dict[ChatKey, int] = {}
+        self.has_writes = asyncio.Event()
+        self.flush_lock = asyncio.Lock()
+        self.writer: Optional[Task] = None
+        self.flushed = 0
+        self.failed = 0
+
+    async def connect(self, app: "Application"):
+        # состояние загружается до запуска пуллеров, поэтому первое же событие видит восстановленные игры
+        await self.load()
+        self.writer = asyncio.create_task(self._write_behind())
+
+    async def close(self, app: "Application"):
+        """Дописывает оставшиеся изменения; вызывается после остановки обработчиков, но до закрытия базы"""
+
+        if self.writer:
+            self.writer.cancel()
+            await asyncio.gather(self.writer, return_exceptions=True)
+            self.writer = None
+        try:
+            await self.flush()
+        except SQLAlchemyError as e:
+            self.logger.error(f"{len(self.writes)} game state writes were lost", exc_info=e)
+
+    async def load(self):
+        async with self.app.database.session() as get_session:
+            sessions = (await get_session.execute(select(GameSessionModel))).scalars().all()
+            players = (await get_session.execute(select(SessionPlayerModel, PlayerModel).join(
+                PlayerModel, PlayerModel.id == SessionPlayerModel.player_id
+            ))).all()
+            barrels = (await get_session.execute(
+                select(BarrelModel.group_id, BarrelModel.bag_id, BarrelModel.barrel_number)
+            )).all()
+            card_cells = (await get_session.execute(select(CardCellModel))).scalars().all()
+            handled = (await get_session.execute(select(HandledMessageModel))).scalars().all()
+            await get_session.commit()
+
+        self.handled = {(message.group_id, message.peer_id): message.message_id for message in handled}
+
+        self.sessions = {
+            (session.group_id, session.chat_id): SessionState(session=GameSession(
+                group_id=session.group_id, chat_id=session.chat_id,
+                start_date=session.start_date, last_event_date=session.last_event_date,
+                type=session.type, status=session.status
+            )) for session in sessions
+        }
+        profiles: dict[int, Player] = {}
+        for session_player, player in players:
+            state = self.sessions[session_player.group_id, session_player.session_id]
+            state.players[player.id] = SessionPlayer(
+                session_id=session_player.session_id, player_id=session_player.player_id,
+                card_number=session_player.card_number, role=session_player.role
+            )
+            # один и тот же игрок в нескольких беседах - один профиль
+            state.profiles[player.id] = profiles.setdefault(player.id, Player(
+                id=player.id, name=player.name,
+                times_won=player.times_won, times_led=player.times_led, times_played=player.times_played
+            ))
+        for state in self.sessions.values():
+            if state.session.status in ("handling moves", "summing up"):
+                state.bag = set()
+        for group_id, bag_id, barrel_number in barrels:
+            state = self.sessions[group_id, bag_id]
+            state.bag = state.bag or set()
+            state.bag.add(barrel_number)
+        for card_cell in sorted(card_cells, key=lambda cell: (cell.row_index, cell.cell_index)):
+            state = self.sessions[card_cell.group_id, card_cell.session_id]
+            state.cards.setdefault(card_cell.player_id, []).append(CardCell(
+                session_id=card_cell.session_id, player_id=card_cell.player_id,
+                row_index=card_cell.row_index, cell_index=card_cell.cell_index,
+                barrel_number=card_cell.barrel_number, is_covered=card_cell.is_covered
+            ))
+        self.logger.info(f"game state: {len(self.sessions)} sessions restored")
+
+    def _write(self, *statements: Executable):
+        self.writes.extend(statements)
+        self.has_writes.set()
+
+    async def _write_behind(self):
+        while True:
+            await self.has_writes.wait()
+            # изменения нескольких ходов и бесед собираются в одну транзакцию
+            await asyncio.sleep(self.config.flush_interval)
+            try:
+                await self.flush()
+            except SQLAlchemyError as e:
+                self.logger.error("Game state was not written, retrying", exc_info=e)
+                await asyncio.sleep(self.config.retry_delay)
+
+    async def flush(self):
+        """Записывает накопленные изменения в базу. Если база недоступна, изменения остаются в очереди"""
+
+        async with self.flush_lock:
+            while self.writes:
+                batch = self.writes[:self.config.batch_size]
+                try:
+                    await self._execute(batch)
+                except (OperationalError, InterfaceError):
+                    raise
+                except SQLAlchemyError as e:
+                    # один неверный запрос не должен терять всю пачку
+                    self.logger.error("Game state batch failed, writing it statement by statement", exc_info=e)
+                    await self._execute_one_by_one(len(batch))
+                    continue
+                del self.writes[:len(batch)]
+                self.flushed += len(batch)
+            self.unsaved_profiles.clear()
+            self.has_writes.clear()
+            if self.stale_profiles:
+                await self._reload_stale_profiles()
+
+    async def _reload_stale_profiles(self):
+        try:
+            players = await self.app.store.loto_games.get_players_by_ids(list(self.stale_profiles))
+        except SQLAlchemyError as e:
+            self.logger.warning("stale profiles were not reloaded", exc_info=e)
+            return
+        if self.writes:
+            return  # пока шло чтение, статистика изменилась ещё раз - перечитается после следующей записи
+
+        for player in players:
+            # профиль меняется на месте: тот же объект уже лежит в сессиях, где играет игрок
+            profile = self.stale_profiles[player.id]
+            profile.name = player.name
+            profile.times_won, profile.times_led = player.times_won, player.times_led
+            profile.times_played = player.times_played
+        self.stale_profiles.clear()
+
+    async def _execute(self, batch: list[Executable]):
+        async with self.app.database.session() as write_session:
+            for statement in batch:
+                await write_session.execute(statement)
+            await write_session.commit()
+
+    async def _execute_one_by_one(self, amount: int):
+        # записанные запросы сразу убираются из очереди, чтобы после обрыва связи не выполнить их повторно
+        for _ in range(amount):
+            statement = self.writes[0]
+            try:
+                await self._execute([statement])
+                self.flushed += 1
+            except (OperationalError, InterfaceError):
+                raise
+            except SQLAlchemyError as e:
+                self.failed += 1
+                self.logger.error(f"Game state write was dropped: {statement}", exc_info=e)
+            del self.writes[0]
+
+    def stats(self) -> dict:
+        return {
+            "sessions": len(self.sessions),
+            "pending_writes": len(self.writes),
+            "flushed_writes": self.flushed,
+            "failed_writes": self.failed,
+        }
+
+    def is_handled(self, key: ChatKey, message_id: int) -> bool:
+        return bool(message_id) and message_id <= self.handled.get(key, 0)
+
+    def mark_handled(self, key: ChatKey, message_id: int):
+        """Запоминает команду беседы как выполненную; отметка уходит в базу после изменений, сделанных командой"""
+
+        if not message_id or message_id <= self.handled.get(key, 0):
+            return
+        self.handled[key] = message_id
+        group_id, peer_id = key
+        query_handled = insert(HandledMessageModel).values(group_id=group_id, peer_id=peer_id, message_id=message_id)
+        self._write(query_handled.on_duplicate_key_update(
+            message_id=func.GREATEST(HandledMessageModel.message_id, query_handled.inserted.message_id)
+        ))
+
+    def get(self, key: ChatKey) -> Optional[SessionState]:
+        return self.sessions.get(key)
+
+    def create_session(self, key: ChatKey, game_type: str) -> Optional[int]:
+        if key in self.sessions:
+            return None
+
+        group_id, chat_id = key
+        start_date = datetime.now()
+        session = GameSession(
+            group_id=group_id, chat_id=chat_id, start_date=start_date, last_event_date=start_date,
+            type="short" if game_type == "2" else "simple", status="started"
+        )
+        self.sessions[key] = SessionState(session=session)
+        self._write(insert(GameSessionModel).values(
+            group_id=group_id, chat_id=chat_id, type=session.type, status=session.status,
+            start_date=start_date, last_event_date=start_date
+        ))
+        return chat_id
+
+    @staticmethod
+    def _session_filter(key: ChatKey):
+        group_id, chat_id = key
+        return and_(GameSessionModel.group_id == group_id, GameSessionModel.chat_id == chat_id)
+
+    def set_session_status(self, key: ChatKey, new_status: str):
+        self.sessions[key].session.status = new_status
+        self._write(update(GameSessionModel).where(self._session_filter(key)).values(status=new_status))
+
+    async def _get_profile(self, chat_id: int, player_id: int) -> Player:
+        for state in self.sessions.values():
+            if player_id in state.profiles:
+                return state.profiles[player_id]
+        if player_id in self.unsaved_profiles:
+            return self.unsaved_profiles[player_id]
+        if player_id in self.stale_profiles:
+            return self.stale_profiles[player_id]
+
+        stale = False
+        try:
+            players = await self.app.store.loto_games.get_players_by_ids([player_id])
+        except SQLAlchemyError as e:
+            # игрок всё равно может участвовать: имя берётся из VK, а статистика обновится запросами относительно
+            self.logger.warning(f"profile of player {player_id} was not loaded", exc_info=e)
+            players, stale = [], True
+        if players:
+            return players[0]
+
+        player_data = await self.app.store.vk_api.get_chat_user(chat_id, player_id)
+        player = Player(
+            id=player_id, name=" ".join([player_data["first_name"], player_data["last_name"]]),
+            times_won=0, times_led=0, times_played=0
+        )
+        query_add_player = insert(PlayerModel).values(
+            id=player.id, name=player.name, times_won=0, times_led=0, times_played=0
+        )
+        self._write(query_add_player.on_duplicate_key_update(name=query_add_player.inserted.name))
+        if stale:
+            self.stale_profiles[player_id] = player
+        else:
+            self.unsaved_profiles[player_id] = player
+        return player
+
+    async def add_lead(self, key: ChatKey, player_id: int):
+        group_id, chat_id = key
+        state = self.sessions[key]
+        state.profiles[player_id] = await self._get_profile(chat_id, player_id)
+        state.players[player_id] = SessionPlayer(session_id=chat_id, player_id=player_id, card_number=None, role="lead")
+        self._write(insert(SessionPlayerModel).values(
+            group_id=group_id, session_id=chat_id, player_id=player_id, role="lead", card_number=None
+        ))
+
+    def get_random_free_card(self, key: ChatKey) -> Optional[int]:
+        allocated_card_numbers = {player.card_number for player in self.sessions[key].players.values()}
+        free_card_numbers = list(set(range(1, self.app.cards.cards_amount + 1)) - allocated_card_numbers)
+        return choice(free_card_numbers) if free_card_numbers else None
+
+    async def add_player(self, key: ChatKey, player_id: int, card_number: int) -> list[CardCell]:
+        """Выдаёт игроку карточку; если карточка у него уже есть, возвращает пустой список"""
+
+        group_id, chat_id = key
+        state = self.sessions[key]
+        if player_id in state.cards:
+            return []
+        profile = await self._get_profile(chat_id, player_id)
+        lead = state.players.get(player_id)
+        state.profiles[player_id] = profile
+        state.players[player_id] = SessionPlayer(
+            session_id=chat_id, player_id=player_id, card_number=card_number,
+            role="leadplayer" if lead else "player"
+        )
+        card_config = self.app.cards.cards[card_number - self.INDEX_OFFSET]
+        state.cards[player_id] = [
+            CardCell(
+                session_id=chat_id, player_id=player_id,
+                row_index=i + self.INDEX_OFFSET, cell_index=j + self.INDEX_OFFSET,
+                barrel_number=value, is_covered=False
+            ) for i, card_row in enumerate([card_config.r_1, card_config.r_2, card_config.r_3])
+            for j, value in enumerate(card_row)
+        ]
+
+        self._write(
+            insert(SessionPlayerModel).values(
+                group_id=group_id, session_id=chat_id, player_id=player_id, role="player", card_number=card_number
+            ).on_duplicate_key_update(card_number=func.ifnull(
+                SessionPlayerModel.card_number, card_number
+            ), role=func.IF(
+                SessionPlayerModel.role == "lead", "leadplayer", SessionPlayerModel.role
+            )),
+            insert(CardCellModel).values([
+                dict(
+                    group_id=group_id, session_id=card_cell.session_id, player_id=card_cell.player_id,
+                    row_index=card_cell.row_index, cell_index=card_cell.cell_index,
+                    barrel_number=card_cell.barrel_number, is_covered=False
+                ) for card_cell in state.cards[player_id]
+            ])
+        )
+        return state.cards[player_id]
+
+    def add_barrels_to_session(self, key: ChatKey) -> bool:
+        group_id, chat_id = key
+        state = self.sessions[key]
+        if state.bag is not None:
+            return False
+
+        state.bag = set(range(1, self.BARRELS_AMOUNT + 1))
+        self._write(insert(BarrelModel).values([
+            dict(group_id=group_id, bag_id=chat_id, barrel_number=barrel_number)
+            for barrel_number in sorted(state.bag)
+        ]))
+        return True
+
+    def pull_barrels(self, key: ChatKey, picked_numbers: list[int]):
+        """Достаёт бочонки из мешка и закрывает их номера на карточках"""
+
+        group_id, chat_id = key
+        state = self.sessions[key]
+        state.bag.difference_update(picked_numbers)
+        picked = set(picked_numbers)
+        for card in state.cards.values():
+            for card_cell in card:
+                if card_cell.barrel_number in picked:
+                    card_cell.is_covered = True
+
+        self._write(
+            delete(BarrelModel).where(and_(
+                BarrelModel.group_id == group_id, BarrelModel.bag_id == chat_id,
+                BarrelModel.barrel_number.in_(picked_numbers)
+            )),
+            update(CardCellModel).where(and_(
+                CardCellModel.group_id == group_id, CardCellModel.session_id == chat_id,
+                CardCellModel.barrel_number.in_(picked_numbers)
+            )).values(is_covered=True)
+        )
+
+    def set_players_status(self, key: ChatKey, players_ids: list[int], played=False, won=False, lead=False):
+        if not players_ids:
+            return
+
+        state = self.sessions[key]
+        updates = {}
+        for player_id in players_ids:
+            profile = state.profiles[player_id]
+            profile.times_played += played
+            profile.times_won += won
+            profile.times_led += lead
+            self.unsaved_profiles[player_id] = profile
+        if played:
+            updates["times_played"] = PlayerModel.times_played + 1
+        if won:
+            updates["times_won"] = PlayerModel.times_won + 1
+        if lead:
+            updates["times_led"] = PlayerModel.times_led + 1
+        self._write(update(PlayerModel).where(PlayerModel.id.in_(players_ids)).values(updates))
+
+    def delete_session(self, key: ChatKey):
+        if self.sessions.pop(key, None) is not None:
+            self._write(delete(GameSessionModel).where(self._session_filter(key)))
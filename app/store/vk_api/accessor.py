@@ -1,15 +1,25 @@
+import asyncio
 import enum
 import json
 import random
+import time
 import typing
-from typing import Optional
+from functools import partial
+from typing import Any, Awaitable, BinaryIO, Callable, Optional
+from urllib.parse import unquote
 
-from aiohttp import TCPConnector
+from aiohttp import ClientError, FormData, TCPConnector
 from aiohttp.client import ClientSession
 
 from app.base.base_accessor import BaseAccessor
+from app.base.ttl_cache import TTLCache
+from app.store.vk_api.batcher import ExecuteBatcher, PendingCall
 from app.store.vk_api.dataclasses import Message
+from app.store.vk_api.errors import CircuitOpenError, VkApiError
+from app.store.vk_api.group import VkGroup, current_group_id
 from app.store.vk_api.poller import Poller
+from app.store.vk_api.retry import CircuitBreaker, RetryPolicy
+from app.store.vk_api.scheduler import Priority
 
 if typing.TYPE_CHECKING:
     from app.web.app import Application
@@ -18,91 +28,240 @@ if typing.TYPE_CHECKING:
 # TODO: fix graceful shutdown
 class VkApiAccessor(BaseAccessor):
     API_PATH = "https://api.vk.com/method/"
+    API_VERSION = "5.131"
 
     class VkApiFail(enum.Enum):
+        history_outdated = 1
         key_timeout = 2
+        info_lost = 3
 
     def __init__(self, app: "Application", *args, **kwargs):
         super().__init__(app, *args, **kwargs)
         self.session: Optional[ClientSession] = None
-        self.key: Optional[str] = None
-        self.server: Optional[str] = None
-        self.poller: Optional[Poller] = None
-        self.ts: Optional[int] = None
+        config = self.app.config.vk_api
+        self.groups: dict[int, VkGroup] = {
+            group_config.group_id: VkGroup(group_config, config) for group_config in self.app.config.bot.groups
+        }
+        self.upload_semaphore = asyncio.Semaphore(config.upload_concurrency)
+        self.upload_urls = TTLCache(config.upload_url_ttl)
+        self.upload_url_requests: dict[tuple[int, str, int], asyncio.Task] = {}
+        self.retry_policy = RetryPolicy(
+            attempts=config.retry_attempts, base_delay=config.retry_base_delay,
+            max_delay=config.retry_max_delay, jitter=config.retry_jitter
+        )
+        self.chat_members = TTLCache(config.chat_members_ttl, config.chat_members_cache_size)
+        self.upload_latency = 0.0
+        self.upload_latency_at = 0.0
 
     async def connect(self, app: "Application"):
+        # одно соединение с общим пулом на все сообщества
         self.session = ClientSession(connector=TCPConnector(verify_ssl=False))
-        try:
-            await self._get_long_poll_service()
-        except Exception as e:
-            self.logger.error("Exception", exc_info=e)
-        self.poller = Poller(app.store)
-        self.logger.info("start polling")
-        await self.poller.start()
+        config = self.app.config.vk_api
+        long_poll = self.app.config.bot.mode == "long_poll"
+        for group in self.groups.values():
+            if config.batching:
+                group.batcher = ExecuteBatcher(partial(self._execute, group), config.batch_window, config.batch_size)
+            if long_poll:
+                try:
+                    await self._get_long_poll_service(group)
+                    await self._resume_long_poll(group)
+                except Exception as e:
+                    self.logger.error("Exception", exc_info=e)
+            group.poller = Poller(app.store, group)
+            self.logger.info(f"group {group.id}: start {'polling' if long_poll else 'handling callback events'}")
+            await group.poller.start(long_poll)
 
     async def disconnect(self, app: "Application"):
-        if self.poller:
-            await self.poller.stop()
+        for group in self.groups.values():
+            if group.poller:
+                await group.poller.stop()
+            if group.batcher:
+                await group.batcher.close()
         if self.session:
             await self.session.close()
 
+    def stats(self) -> dict:
+        return {
+            "groups": {group.id: group.stats() for group in self.groups.values()},
+            "upload_urls": self.upload_urls.stats(),
+            "chat_members": self.chat_members.stats(),
+            "upload_latency": self.upload_latency,
+        }
+
+    @property
+    def group(self) -> VkGroup:
+        """Сообщество обновления, которое сейчас обрабатывается; вне обработки - первое из конфига"""
+
+        group_id = current_group_id.get()
+        if group_id is None:
+            return next(iter(self.groups.values()))
+        return self.groups[group_id]
+
     @staticmethod
     def _build_query(host: str, method: str, params: dict) -> str:
         url = host + method + "?"
         if "v" not in params:
-            params["v"] = "5.131"
+            params["v"] = VkApiAccessor.API_VERSION
         url += "&".join([f"{k}={v}" for k, v in params.items()])
         return url
 
-    async def _get_long_poll_service(self):
-        async with self.session.get(
-                self._build_query(
-                    host=self.API_PATH,
-                    method="groups.getLongPollServer",
-                    params={
-                        "group_id": self.app.config.bot.group_id,
-                        "access_token": self.app.config.bot.token,
-                    },
-                )
-        ) as resp:
-            data = (await resp.json())["response"]
+    async def _request(self, group: VkGroup, method: str, params: dict, priority: Priority) -> Any:
+        params = params | {"access_token": group.token}
+        await group.scheduler.acquire(priority)
+        group.requests_sent += 1
+        async with self.session.get(self._build_query(self.API_PATH, method, params=params)) as resp:
+            data = await resp.json()
+            self.logger.info(data)
+        if "error" in data:
+            raise VkApiError.from_response(method, data["error"])
+        return data["response"]
+
+    @staticmethod
+    def _build_execute_code(calls: list[PendingCall]) -> str:
+        api_calls = []
+        for call in calls:
+            # _build_query не экранирует параметры, поэтому тексты приходят с %0A и %2B
+            params = {k: unquote(v) if isinstance(v, str) else v for k, v in call.params.items()}
+            api_calls.append(f"API.{call.method}({json.dumps(params, ensure_ascii=False)})")
+        return f"return [{','.join(api_calls)}];"
+
+    async def _execute(self, group: VkGroup, calls: list[PendingCall]) -> list[Any]:
+        if len(calls) == 1:
+            try:
+                return [await self._request(group, calls[0].method, calls[0].params, calls[0].priority)]
+            except VkApiError as e:
+                return [e]
+
+        await group.scheduler.acquire(min(call.priority for call in calls))
+        group.requests_sent += 1
+        async with self.session.post(self.API_PATH + "execute", data={
+            "code": self._build_execute_code(calls),
+            "access_token": group.token,
+            "v": self.API_VERSION,
+        }) as resp:
+            data = await resp.json()
             self.logger.info(data)
-            self.key = data["key"]
-            self.server = data["server"]
-            self.ts = data["ts"]
-            self.logger.info(self.server)
+        if "error" in data:
+            raise VkApiError.from_response("execute", data["error"])
 
-    async def poll(self):
+        execute_errors = iter(data.get("execute_errors", []))
+        results = []
+        for call, result in zip(calls, data["response"]):
+            if result is False:
+                error = next(execute_errors, {})
+                result = VkApiError(call.method, error.get("error_code", 0), error.get("error_msg", ""))
+            results.append(result)
+        return results
+
+    def _is_retryable(self, error: Exception) -> bool:
+        if isinstance(error, VkApiError):
+            return error.code in self.retry_policy.retryable_codes
+        return isinstance(error, (ClientError, asyncio.TimeoutError))
+
+    def _get_breaker(self, group: VkGroup, method: str) -> CircuitBreaker:
+        if method not in group.breakers:
+            config = self.app.config.vk_api
+            group.breakers[method] = CircuitBreaker(config.breaker_threshold, config.breaker_reset_timeout)
+        return group.breakers[method]
+
+    async def _with_retry(self, group: VkGroup, method: str, attempt_call: Callable[[], Awaitable[Any]]) -> Any:
+        breaker = self._get_breaker(group, method)
+        for attempt in range(self.retry_policy.attempts):
+            if not breaker.allow():
+                raise CircuitOpenError(method)
+            try:
+                result = await attempt_call()
+            except Exception as e:
+                if not self._is_retryable(e):
+                    if isinstance(e, VkApiError):
+                        breaker.record_success()  # VK ответил, пусть и ошибкой в запросе
+                    else:
+                        # иначе полуоткрытая цепь так и осталась бы ждать результата пробного вызова
+                        breaker.record_failure()
+                    raise
+                breaker.record_failure()
+                if attempt + 1 == self.retry_policy.attempts:
+                    raise
+                self.logger.warning(f"{method} failed, retrying", exc_info=e)
+                await asyncio.sleep(self.retry_policy.delay(attempt))
+            except BaseException:
+                breaker.abort()
+                raise
+            else:
+                breaker.record_success()
+                return result
+
+    async def _call(
+            self, method: str, params: dict, priority: Priority = Priority.game, batched: bool = True
+    ) -> Any:
+        group = self.group
+        if batched and group.batcher:
+            return await self._with_retry(group, method, lambda: group.batcher.call(method, params, priority))
+        return await self._with_retry(group, method, lambda: self._request(group, method, params, priority))
+
+    async def _resume_long_poll(self, group: VkGroup):
+        """Продолжает long poll с последнего сохранённого ts, чтобы не потерять события, пришедшие без бота"""
+
+        state = await self.app.store.long_poll_states.get_state(group.id)
+        if state is None or state.ts >= group.ts:
+            return
+        self.logger.info(f"group {group.id}: catching up from ts {state.ts} to {group.ts}")
+        group.ts = state.ts
+        group.catching_up = True
+
+    async def _get_long_poll_service(self, group: VkGroup, keep_ts: bool = False):
+        method = "groups.getLongPollServer"
+        data = await self._with_retry(
+            group, method, lambda: self._request(group, method, {"group_id": group.id}, Priority.game)
+        )
+        group.key = data["key"]
+        group.server = data["server"]
+        if not keep_ts:
+            group.ts = int(data["ts"])
+        self.logger.info(group.server)
+
+    async def poll(self, group: VkGroup):
+        if group.server is None:
+            # сервер long poll не удалось получить при запуске
+            await self._get_long_poll_service(group)
+            await self._resume_long_poll(group)
         async with self.session.get(
                 self._build_query(
-                    host=self.server,
+                    host=group.server,
                     method="",
                     params={
                         "act": "a_check",
-                        "key": self.key,
-                        "ts": self.ts,
-                        "wait": 30,
+                        "key": group.key,
+                        "ts": group.ts,
+                        # при догоняющем чтении накопленные события забираются без ожидания
+                        "wait": 0 if group.catching_up else 30,
                     },
                 )
         ) as resp:
             json_data = await resp.json()
             self.logger.info(json_data)
-            try:
-                self.ts = json_data["ts"]
-                updates = json_data["updates"]
-            except KeyError:
-                match self.VkApiFail(json_data["failed"]):
-                    case self.VkApiFail.key_timeout:
-                        await self._get_long_poll_service()
-                        updates = []
-            return updates
+            if "failed" not in json_data:
+                group.ts = int(json_data["ts"])
+                return json_data["updates"]
+
+            match self.VkApiFail(json_data["failed"]):
+                case self.VkApiFail.history_outdated:
+                    self.logger.warning(f"group {group.id}: long poll history is outdated, some events are lost")
+                    group.ts = int(json_data["ts"])
+                case self.VkApiFail.key_timeout:
+                    # истёк только ключ, события после текущего ts ещё можно получить
+                    await self._get_long_poll_service(group, keep_ts=True)
+                case self.VkApiFail.info_lost:
+                    self.logger.warning(f"group {group.id}: long poll info is lost, some events are lost")
+                    await self._get_long_poll_service(group)
+            return []
 
     async def send_message(
             self, message: Message, peer_id: int, reply_id: Optional[int] = None, attachment="",
-            disable_mentions=False
+            disable_mentions=False, priority: Priority = Priority.game
     ) -> None:
         (destination, id_) = ("user", message.user_id) if message.user_id == peer_id else ("chat", peer_id - 2000000000)
-        peer_id = peer_id if message.user_id != peer_id else -self.app.config.bot.group_id
+        peer_id = peer_id if message.user_id != peer_id else -self.group.id
         params = {
             f"{destination}_id": id_,
             "random_id": random.randint(1, 2 ** 32),
@@ -110,7 +269,6 @@ class VkApiAccessor(BaseAccessor):
             "message": message.text,
             "attachment": attachment,
             "disable_mentions": int(disable_mentions),
-            "access_token": self.app.config.bot.token,
         }
         if reply_id:
             params["forward"] = json.dumps({
@@ -118,83 +276,134 @@ class VkApiAccessor(BaseAccessor):
                 "conversation_message_ids": [reply_id],
                 "is_reply": True
             })
-        async with self.session.get(
-                self._build_query(
-                    self.API_PATH,
-                    "messages.send",
-                    params=params,
-                )
-        ) as resp:
-            data = await resp.json()
-            self.logger.info(data)
+        try:
+            await self._call("messages.send", params, priority)
+        except VkApiError as e:
+            self.logger.error("Message was not sent", exc_info=e)
+
+    async def _get_chat_members(self, chat_id: int) -> dict[int, dict[str, int | str]]:
+        members = self.chat_members.get((self.group.id, chat_id))
+        if members is None:
+            data = await self._call("messages.getConversationMembers", {"peer_id": chat_id})
+            profiles = {profile["id"]: profile for profile in data["profiles"]}
+            members = {
+                item["member_id"]: {
+                    "member_id": item["member_id"], "is_admin": "is_admin" in item, "id": item["member_id"],
+                    "first_name": profiles[item["member_id"]]["first_name"],
+                    "last_name": profiles[item["member_id"]]["last_name"],
+                } for item in data["items"] if item["member_id"] in profiles
+            }
+            self.chat_members.set((self.group.id, chat_id), members)
+        return members
+
+    def invalidate_chat_members(self, chat_id: int):
+        self.chat_members.invalidate((self.group.id, chat_id))
+
+    async def get_chat_users(self, chat_id: int, user_ids: list[int]) -> list[dict[str, int | str]]:
+        members = await self._get_chat_members(chat_id)
+        if any(user_id not in members for user_id in user_ids):
+            # участник мог появиться в беседе после того, как список был закэширован
+            self.invalidate_chat_members(chat_id)
+            members = await self._get_chat_members(chat_id)
+        return [members[user_id] for user_id in user_ids]
 
     async def get_chat_user(self, chat_id: int, user_id: int) -> dict[str, int | str]:
-        async with self.session.get(
-                self._build_query(
-                    self.API_PATH,
-                    "messages.getConversationMembers",
-                    params={
-                        "access_token": self.app.config.bot.token,
-                        "peer_id": chat_id
-                    }
-                )
-        ) as resp:
-            data = (await resp.json())["response"]
-            self.logger.info(data)
-            items = [
-                {"member_id": item["member_id"], "is_admin": "is_admin" in item}
-                for item in data["items"]
-            ]
-            profiles = [
-                {"id": profile["id"], "first_name": profile["first_name"], "last_name": profile["last_name"]}
-                for profile in data["profiles"]
-            ]
-            item = list(filter(lambda item: (item["member_id"] == user_id), items))[0]
-            user = list(filter(lambda profile: (profile["id"] == user_id), profiles))[0]
-            user = item | user
-            return user
-
-    async def post_doc(self, doc_path: str) -> str:
-        async with self.session.get(
-                self._build_query(
-                    self.API_PATH,
-                    "docs.getMessagesUploadServer",
-                    params={
-                        "access_token": self.app.config.bot.token,
-                        "type": "doc",
-                        "peer_id": self.app.config.bot.admin_id  # VK moment
-                    }
-                )
-        ) as resp:
-            data = (await resp.json())["response"]
-            self.logger.info(data)
-            self.logger.info(f"{{'file':'{doc_path}'}}")
-            upload_url = data["upload_url"]
+        user, = await self.get_chat_users(chat_id, [user_id])
+        return user
 
-        # TODO: find the way to solve error 'no_file'
-        async with self.session.post(upload_url, data={"file": open(doc_path, "rb")}) as resp:
-            data = (await resp.json(content_type='application/json'))
-            self.logger.info(data)
-            # I dunno what to do
-            if "file" not in data:
-                return ""
-            file = data["file"]
+    async def is_chat_admin(self, chat_id: int, user_id: int) -> bool:
+        """Права проверяются по свежему списку участников: снятие админа не приходит событием в беседу"""
 
-        async with self.session.get(
-                self._build_query(
-                    self.API_PATH,
-                    "docs.save",
-                    params={
-                        "access_token": self.app.config.bot.token,
-                        "file": file
-                    }
-                )
-        ) as resp:
-            data = (await resp.json())["response"]
-            self.logger.info(data)
-            type_ = data["type"]
-            id_ = data[type_]["id"]
-            owner_id = data[type_]["owner_id"]
-            doc_ref = f"{type_}{owner_id}_{id_}_{self.app.config.bot.token}"
+        self.invalidate_chat_members(chat_id)
+        members = await self._get_chat_members(chat_id)
+        return user_id in members and members[user_id]["is_admin"]
+
+    @staticmethod
+    def _read_doc(doc: str | bytes | BinaryIO) -> bytes:
+        if isinstance(doc, str):
+            with open(doc, "rb") as f:
+                return f.read()
+        if isinstance(doc, (bytes, bytearray, memoryview)):
+            return bytes(doc)
+        return doc.read()
+
+    async def _request_upload_url(self, upload_key: tuple[int, str, int]) -> str:
+        group_id, type_, peer_id = upload_key
+        # без своих повторов: адрес запрашивается внутри повторов docs.upload, иначе запросов было бы attempts²
+        data = await self._request(self.groups[group_id], "docs.getMessagesUploadServer", {
+            "type": type_,
+            "peer_id": peer_id
+        }, Priority.upload)
+        self.upload_urls.set(upload_key, data["upload_url"])
+        return data["upload_url"]
+
+    async def _get_upload_url(self, upload_key: tuple[int, str, int]) -> str:
+        upload_url = self.upload_urls.get(upload_key)
+        if upload_url is not None:
+            return upload_url
+
+        # одновременные промахи по одному ключу ждут один и тот же запрос
+        request = self.upload_url_requests.get(upload_key)
+        if request is None:
+            request = asyncio.create_task(self._request_upload_url(upload_key))
+            self.upload_url_requests[upload_key] = request
+            request.add_done_callback(lambda _: self.upload_url_requests.pop(upload_key, None))
+        return await asyncio.shield(request)
+
+    async def _upload_file(self, payload: bytes, filename: str) -> str:
+        upload_key = (self.group.id, "doc", self.group.admin_id)  # VK moment
+        upload_url = await self._get_upload_url(upload_key)
+
+        form = FormData()
+        form.add_field("file", payload, filename=filename, content_type="image/png")
+        try:
+            async with self.session.post(upload_url, data=form) as resp:
+                data = (await resp.json(content_type='application/json'))
+                self.logger.info(data)
+        except Exception:
+            self.upload_urls.invalidate(upload_key)
+            raise
+        if "file" not in data:
+            self.upload_urls.invalidate(upload_key)
+            raise VkApiError("docs.upload", 0, data.get("error", "no file in response"))
+        return data["file"]
+
+    async def post_doc(self, doc: str | bytes | BinaryIO, filename: str = "card.png") -> str:
+        payload = self._read_doc(doc)
+        file = await self._with_retry(self.group, "docs.upload", lambda: self._upload_file(payload, filename))
+
+        data = await self._call("docs.save", {"file": file}, Priority.upload)
+        type_ = data["type"]
+        id_ = data[type_]["id"]
+        owner_id = data[type_]["owner_id"]
+        doc_ref = f"{type_}{owner_id}_{id_}_{self.group.token}"
 
         return doc_ref
+
+    async def _upload_doc(self, doc: bytes) -> str:
+        started = time.monotonic()
+        async with self.upload_semaphore:
+            try:
+                return await self.post_doc(doc)
+            except Exception as e:
+                self.logger.error("Document was not uploaded", exc_info=e)
+                return ""
+            finally:
+                # вместе с ожиданием семафора: очередь загрузок тоже задерживает ответ игрокам
+                self.upload_latency_at = time.monotonic()
+                self.upload_latency = self.upload_latency_at - started
+
+    def recent_upload_latency(self, max_age: float) -> float:
+        """Длительность последней загрузки документа, если она была не раньше max_age секунд назад, иначе 0"""
+
+        if time.monotonic() - self.upload_latency_at > max_age:
+            return 0.0
+        return self.upload_latency
+
+    async def post_docs(self, docs: list[str | bytes | BinaryIO]) -> list[str]:
+        """Загружает документы одновременно, но не больше vk_api.upload_concurrency за раз.
+
+        Для документов, которые не удалось загрузить с учётом повторов, возвращает пустую строку.
+        """
+
+        return list(await asyncio.gather(*[self._upload_doc(self._read_doc(doc)) for doc in docs]))
@@ -0,0 +1,84 @@
+import asyncio
+from asyncio import Future, Task, TimerHandle
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Optional
+
+from app.store.vk_api.scheduler import Priority
+
+
+@dataclass
+class PendingCall:
+    method: str
+    params: dict
+    priority: Priority
+    future: Future
+
+
+class ExecuteBatcher:
+    """Собирает вызовы API за короткое окно и отправляет их одним запросом execute"""
+
+    MAX_CALLS = 25  # ограничение VK на количество обращений к API внутри execute
+
+    def __init__(
+            self, execute: Callable[[list[PendingCall]], Awaitable[list[Any]]], window: float, size: int = MAX_CALLS
+    ):
+        self.execute = execute
+        self.window = window
+        self.size = min(size, self.MAX_CALLS)
+        self.pending: list[PendingCall] = []
+        self.flush_handle: Optional[TimerHandle] = None
+        self.tasks: set[Task] = set()
+        self.calls = 0
+        self.batches = 0
+
+    async def call(self, method: str, params: dict, priority: Priority) -> Any:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append(PendingCall(method, params, priority, future))
+        if len(self.pending) >= self.size:
+            self._flush()
+        elif self.flush_handle is None:
+            self.flush_handle = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self.flush_handle:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        calls, self.pending = self.pending, []
+        if not calls:
+            return
+        task = asyncio.create_task(self._send(calls))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _send(self, calls: list[PendingCall]):
+        self.calls += len(calls)
+        self.batches += 1
+        try:
+            results = await self.execute(calls)
+        except Exception as e:
+            for call in calls:
+                if not call.future.done():
+                    call.future.set_exception(e)
+            return
+
+        for call, result in zip(calls, results):
+            if call.future.done():
+                continue
+            if isinstance(result, Exception):
+                call.future.set_exception(result)
+            else:
+                call.future.set_result(result)
+
+    async def close(self):
+        self._flush()
+        if self.tasks:
+            await asyncio.wait(self.tasks)
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "batches": self.batches,
+            "pending": len(self.pending),
+        }
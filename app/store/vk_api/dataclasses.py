@@ -1,19 +1,31 @@
-from dataclasses import dataclass
+from asyncio import Future
+from dataclasses import dataclass, field
+from typing import Optional
 
 
-@dataclass
+@dataclass(slots=True)
 class UpdateObject:
     id: int
     user_id: int
     body: str
     peer_id: int
     message_id: int
+    action: Optional[str] = None
+    action_member_id: Optional[int] = None
 
 
-@dataclass
+@dataclass(slots=True)
 class Update:
     type: str
     object: UpdateObject
+    group_id: Optional[int] = None
+    event_id: Optional[str] = None
+    # завершается, когда обновление обработано или выброшено из очереди; по нему сохраняется ts
+    done: Optional[Future] = field(default=None, compare=False, repr=False)
+
+    def mark_done(self):
+        if self.done is not None and not self.done.done():
+            self.done.set_result(None)
 
 
 @dataclass
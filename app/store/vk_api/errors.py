@@ -0,0 +1,16 @@
+class VkApiError(Exception):
+    def __init__(self, method: str, code: int, message: str):
+        super().__init__(f"{method}: [{code}] {message}")
+        self.method = method
+        self.code = code
+        self.message = message
+
+    @classmethod
+    def from_response(cls, method: str, error: dict) -> "VkApiError":
+        return cls(method, error.get("error_code", 0), error.get("error_msg", ""))
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, method: str):
+        super().__init__(f"{method}: circuit is open")
+        self.method = method
@@ -0,0 +1,42 @@
+from contextvars import ContextVar
+from typing import TYPE_CHECKING, Optional
+
+from app.store.vk_api.batcher import ExecuteBatcher
+from app.store.vk_api.retry import CircuitBreaker
+from app.store.vk_api.scheduler import RequestScheduler
+
+if TYPE_CHECKING:
+    from app.store.vk_api.poller import Poller
+    from app.web.config import GroupConfig, VkApiConfig
+
+# сообщество, от имени которого обрабатывается текущее обновление
+current_group_id: ContextVar[Optional[int]] = ContextVar("current_group_id", default=None)
+
+
+class VkGroup:
+    """Состояние одного сообщества: токен, long poll, собственный лимит запросов и пакетирование"""
+
+    def __init__(self, config: "GroupConfig", vk_api_config: "VkApiConfig"):
+        self.id = config.group_id
+        self.token = config.token
+        self.admin_id = config.admin_id
+        self.config = config
+        self.scheduler = RequestScheduler(vk_api_config.rate_limit, vk_api_config.rate_burst)
+        self.batcher: Optional[ExecuteBatcher] = None
+        self.breakers: dict[str, CircuitBreaker] = {}
+        self.poller: Optional["Poller"] = None
+        self.key: Optional[str] = None
+        self.server: Optional[str] = None
+        self.ts: Optional[int] = None
+        self.catching_up = False
+        self.requests_sent = 0
+
+    def stats(self) -> dict:
+        return {
+            "requests_sent": self.requests_sent,
+            "update_queue": self.poller.queue.stats() if self.poller else None,
+            "long_poll": self.poller.stats() if self.poller else None,
+            "batcher": self.batcher.stats() if self.batcher else None,
+            "scheduler": self.scheduler.stats(),
+            "breakers": {method: breaker.stats() for method, breaker in self.breakers.items()},
+        }
@@ -0,0 +1,55 @@
+from typing import Optional
+
+from app.store.vk_api.dataclasses import Update, UpdateObject
+
+
+class UpdateParser:
+    """Разбирает сырые события Bots API в Update за один проход по каждому событию.
+
+    Кроме обычных сообщений различает приглашение самого бота (chat_invite_yasb),
+    приглашения других участников (chat_invite_user) и исключения (chat_kick_user).
+    Отсутствующие поля заменяются значениями по умолчанию, остальные типы событий отбрасываются.
+    """
+
+    INVITE_ACTIONS = frozenset({"chat_invite_user", "chat_invite_user_by_link"})
+    KICK_ACTIONS = frozenset({"chat_kick_user"})
+
+    def __init__(self, group_id: int):
+        self.group_id = group_id
+
+    def parse_batch(self, raw_updates: list[dict]) -> list[Update]:
+        updates = []
+        bot_member_id = -self.group_id
+        for raw_update in raw_updates:
+            if raw_update.get("type") != "message_new":
+                continue
+            message = (raw_update.get("object") or {}).get("message")
+            if not message or not isinstance(message, dict):
+                continue
+
+            type_ = "message_new"
+            action_type = action_member_id = None
+            action = message.get("action")
+            if action:
+                action_type = action.get("type")
+                action_member_id = action.get("member_id")
+                if action_type in self.INVITE_ACTIONS:
+                    type_ = "chat_invite_yasb" if action_member_id == bot_member_id else "chat_invite_user"
+                elif action_type in self.KICK_ACTIONS:
+                    type_ = "chat_kick_user"
+
+            updates.append(Update(
+                type_,
+                UpdateObject(
+                    message.get("id", 0), message.get("from_id", 0), message.get("text", ""),
+                    message.get("peer_id", 0), message.get("conversation_message_id", 0),
+                    action_type, action_member_id,
+                ),
+                self.group_id,
+                raw_update.get("event_id"),
+            ))
+        return updates
+
+    def parse(self, raw_update: dict) -> Optional[Update]:
+        updates = self.parse_batch([raw_update])
+        return updates[0] if updates else None
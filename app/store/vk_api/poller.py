@@ -1,55 +1,151 @@
 import asyncio
-from asyncio import Future, Task, TimeoutError
-from aiohttp import ClientOSError
-from typing import Optional
+from asyncio import Future, Task
+from typing import TYPE_CHECKING, Optional
 
 from app.store import Store
-from app.store.vk_api.dataclasses import Update, UpdateObject
+from app.store.vk_api.dataclasses import Update
+from app.store.vk_api.parser import UpdateParser
+from app.store.vk_api.update_queue import OverflowPolicy, UpdateQueue
+
+if TYPE_CHECKING:
+    from app.store.vk_api.group import VkGroup
 
 
 # TODO: fix this
 class Poller:
-    def __init__(self, store: Store):
+    def __init__(self, store: Store, group: "VkGroup"):
         self.store = store
+        self.group = group
+        self.parser = UpdateParser(group.id)
         self.is_running = False
         self.poll_task: Optional[Task] = None
+        self.handle_task: Optional[Task] = None
+        config = self.store.vk_api.app.config.poller
+        self.batch_size = config.batch_size
+        self.drain_timeout = config.drain_timeout
+        self.queue = UpdateQueue(config.queue_size, OverflowPolicy(config.overflow), self._is_game_update)
+        self.checkpoint_task: Optional[Task] = None
+        self.saved_ts: Optional[int] = None
 
     def _done_callback(self, future: Future):
-        if future.exception():
+        if not future.cancelled() and future.exception():
             self.store.vk_api.app.logger.exception("polling failed", exc_info=future.exception())
 
-    async def start(self):
+    async def start(self, long_poll: bool = True):
         self.is_running = True
-        self.poll_task = asyncio.create_task(self.poll())
-        self.poll_task.add_done_callback(self._done_callback)
+        if long_poll:
+            self.poll_task = asyncio.create_task(self.poll())
+            self.poll_task.add_done_callback(self._done_callback)
+        self.handle_task = asyncio.create_task(self.handle())
+        self.handle_task.add_done_callback(self._done_callback)
 
     async def stop(self):
         self.is_running = False
         if self.poll_task:
             await asyncio.wait([self.poll_task], timeout=30)
+            self.poll_task.cancel()
+        if self.checkpoint_task:
+            # уже полученные события дообрабатываются, чтобы после перезапуска не повторять их
+            await asyncio.wait([self.checkpoint_task], timeout=self.drain_timeout)
+            self.checkpoint_task.cancel()
+        if self.handle_task:
+            self.handle_task.cancel()
+            await asyncio.wait([self.handle_task])
+
+    def _is_game_update(self, update: Update) -> bool:
+        if update.type != "message_new":
+            return True
+        return self.store.bots_manager.router.route(update.object.body, update.group_id) is not None
 
     async def poll(self):
+        failures = 0
         while self.is_running:
             try:
-                raw_updates = await self.store.vk_api.poll()
-            except ClientOSError:
-                continue
-            except TimeoutError:
+                raw_updates = await self.store.vk_api.poll(self.group)
+            except Exception as e:
+                # цикл опроса не должен завершаться: иначе бот молча перестанет получать события
+                self.store.vk_api.logger.warning("Long poll request failed", exc_info=e)
+                await asyncio.sleep(self.store.vk_api.retry_policy.delay(failures))
+                failures += 1
                 continue
+            failures = 0
+            if self.group.catching_up and not raw_updates:
+                self.group.catching_up = False
+                self.store.vk_api.logger.info(f"group {self.group.id}: long poll backlog is drained")
             if raw_updates:
-                updates = [
-                    Update(
-                        type="chat_invite_yasb" if "action" in raw_update["object"]["message"] and
-                        raw_update["object"]["message"]["action"]["type"] and
-                        raw_update["object"]["message"]["action"]["member_id"] ==
-                        -self.store.bots_manager.app.config.bot.group_id else raw_update["type"],
-                        object=UpdateObject(
-                            id=raw_update["object"]["message"]["id"],
-                            user_id=raw_update["object"]["message"]["from_id"],
-                            body=raw_update["object"]["message"]["text"],
-                            peer_id=raw_update["object"]["message"]["peer_id"],
-                            message_id=raw_update["object"]["message"]["conversation_message_id"]
-                        )
-                    ) for raw_update in raw_updates if (raw_update["type"] == "message_new")
-                ]
-                await self.store.bots_manager.handle_updates(updates)
+                ts = self.group.ts
+                self._checkpoint(ts, await self.push(raw_updates))
+
+    def parse_updates(self, raw_updates: list[dict]) -> list[Update]:
+        return self.parser.parse_batch(raw_updates)
+
+    async def push(self, raw_updates: list[dict]) -> list[Future]:
+        """Кладёт события из long poll или Callback API в очередь обработки.
+
+        Возвращает future для каждого события, которая завершится после его обработки.
+        """
+
+        done = []
+        for update in self._parse_with_done(raw_updates):
+            done.append(update.done)
+            await self.queue.put(update)
+        return done
+
+    def offer(self, raw_updates: list[dict]) -> bool:
+        """Кладёт события в очередь, не дожидаясь места: при переполнении лишние отбрасываются.
+
+        Возвращает, приняты ли все события.
+        """
+
+        accepted = True
+        for update in self._parse_with_done(raw_updates):
+            accepted = self.queue.put_nowait(update) and accepted
+        return accepted
+
+    def _parse_with_done(self, raw_updates: list[dict]) -> list[Update]:
+        loop = asyncio.get_running_loop()
+        updates = self.parse_updates(raw_updates)
+        for update in updates:
+            update.done = loop.create_future()
+        return updates
+
+    def _checkpoint(self, ts: int, done: list[Future]):
+        # ts сохраняются строго по порядку пачек и только после обработки всех событий пачки
+        previous = self.checkpoint_task
+        self.checkpoint_task = asyncio.create_task(self._save_checkpoint(previous, ts, done))
+
+    async def _save_checkpoint(self, previous: Optional[Task], ts: int, done: list[Future]):
+        if previous:
+            await asyncio.wait([previous])
+        if done:
+            await asyncio.wait(done)
+        try:
+            # ts не должен обогнать изменения игр, которые ещё не записаны в базу
+            await self.store.loto_state.flush()
+            await self.store.long_poll_states.save_ts(self.group.id, ts)
+            self.saved_ts = ts
+        except Exception as e:
+            self.store.vk_api.logger.error(f"group {self.group.id}: long poll ts was not saved", exc_info=e)
+
+    def stats(self) -> dict:
+        return {
+            "ts": self.group.ts,
+            "saved_ts": self.saved_ts,
+            "catching_up": self.group.catching_up,
+        }
+
+    def _update_done(self, _: Future):
+        self.queue.mark_processed()
+        self.store.bots_manager.dispatcher.release()
+
+    async def handle(self):
+        dispatcher = self.store.bots_manager.dispatcher
+        while True:
+            # события забираются из очереди, только когда у диспетчера есть место: иначе очередь опустошалась бы
+            # сразу, её предел и политика переполнения не работали бы, а очереди бесед росли бы без ограничений
+            await self.queue.wait()
+            amount = await dispatcher.reserve(min(self.batch_size, len(self.queue)))
+            updates = self.queue.take(amount)
+            for update in updates:
+                update.done.add_done_callback(self._update_done)
+            await self.store.bots_manager.handle_updates(updates)
@@ -0,0 +1,74 @@
+import enum
+import random
+import time
+from dataclasses import dataclass
+
+
+@dataclass
+class RetryPolicy:
+    attempts: int = 3
+    base_delay: float = 0.5
+    max_delay: float = 10.0
+    jitter: float = 0.5
+    # 1 - неизвестная ошибка, 6 - слишком много запросов в секунду, 10 - внутренняя ошибка сервера,
+    # 0 - ошибка без кода от сервера загрузки
+    retryable_codes: frozenset[int] = frozenset({0, 1, 6, 10})
+
+    def delay(self, attempt: int) -> float:
+        delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+        return delay * (1 - self.jitter * random.random())
+
+
+class CircuitState(enum.Enum):
+    closed = "closed"
+    open = "open"
+    half_open = "half_open"
+
+
+class CircuitBreaker:
+    """Перестаёт пропускать вызовы метода после failure_threshold ошибок подряд.
+
+    Через reset_timeout секунд пропускает один пробный вызов: успех закрывает
+    цепь, ошибка снова открывает её.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CircuitState.closed
+        self.failures = 0
+        self.opened_at = 0.0
+        self.rejected = 0
+
+    def allow(self) -> bool:
+        match self.state:
+            case CircuitState.closed:
+                return True
+            case CircuitState.open if time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = CircuitState.half_open
+                return True
+        self.rejected += 1
+        return False
+
+    def record_success(self):
+        self.state = CircuitState.closed
+        self.failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state is CircuitState.half_open or self.failures >= self.failure_threshold:
+            self.state = CircuitState.open
+            self.opened_at = time.monotonic()
+
+    def abort(self):
+        """Вызов прерван без результата (например, отменён): пробным станет следующий вызов"""
+
+        if self.state is CircuitState.half_open:
+            self.state = CircuitState.open
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state.value,
+            "failures": self.failures,
+            "rejected": self.rejected,
+        }
@@ -0,0 +1,81 @@
+import asyncio
+import enum
+import heapq
+import time
+from asyncio import Future, TimerHandle
+from dataclasses import dataclass
+from itertools import count
+from typing import Optional
+
+from app.base.token_bucket import TokenBucket
+
+
+class Priority(enum.IntEnum):
+    game = 0
+    stats = 1
+    upload = 2
+
+
+@dataclass
+class LatencyStats:
+    count: int = 0
+    total: float = 0.0
+    max: float = 0.0
+
+    def record(self, latency: float):
+        self.count += 1
+        self.total += latency
+        self.max = max(self.max, latency)
+
+
+class RequestScheduler:
+    """Пропускает запросы к API не чаще заданного лимита, отдавая токены по приоритету"""
+
+    def __init__(self, rate: float, burst: float):
+        self.bucket = TokenBucket(rate, burst)
+        self.waiters: list[tuple[int, int, float, Future]] = []
+        self.sequence = count()
+        self.release_handle: Optional[TimerHandle] = None
+        self.latency = {priority: LatencyStats() for priority in Priority}
+
+    async def acquire(self, priority: Priority):
+        if not self.waiters and self.bucket.try_acquire():
+            self.latency[priority].record(0.0)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (priority, next(self.sequence), time.monotonic(), future))
+        self._schedule_release()
+        await future
+
+    def _schedule_release(self):
+        if self.release_handle is None:
+            self.release_handle = asyncio.get_running_loop().call_later(self.bucket.delay(), self._release)
+
+    def _release(self):
+        self.release_handle = None
+        while self.waiters:
+            priority, _, enqueued_at, future = self.waiters[0]
+            if future.done():
+                heapq.heappop(self.waiters)
+                continue
+            if not self.bucket.try_acquire():
+                break
+            heapq.heappop(self.waiters)
+            future.set_result(None)
+            self.latency[Priority(priority)].record(time.monotonic() - enqueued_at)
+
+        if self.waiters:
+            self._schedule_release()
+
+    def stats(self) -> dict:
+        return {
+            "waiting": len(self.waiters),
+            "latency": {
+                priority.name: {
+                    "count": stats.count,
+                    "avg": stats.total / stats.count if stats.count else 0.0,
+                    "max": stats.max,
+                } for priority, stats in self.latency.items()
+            },
+        }
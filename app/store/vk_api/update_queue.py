@@ -0,0 +1,108 @@
+import asyncio
+import enum
+from collections import deque
+from typing import Callable
+
+from app.store.vk_api.dataclasses import Update
+
+
+class OverflowPolicy(enum.Enum):
+    block = "block"
+    drop_oldest = "drop_oldest"
+    shed = "shed"
+
+
+class UpdateQueue:
+    """Ограниченная очередь между long-poll запросами и обработкой обновлений.
+
+    При переполнении поведение задаётся политикой: block ждёт освобождения места,
+    drop_oldest выбрасывает самое старое обновление, shed выбрасывает обновления,
+    не относящиеся к игре (is_essential возвращает для них False).
+    """
+
+    def __init__(self, maxsize: int, overflow: OverflowPolicy, is_essential: Callable[[Update], bool]):
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.is_essential = is_essential
+        self.updates: deque[Update] = deque()
+        self.not_empty = asyncio.Event()
+        self.not_full = asyncio.Event()
+        self.not_full.set()
+        self.queued = 0
+        self.dropped = 0
+        self.processed = 0
+
+    async def put(self, update: Update):
+        while len(self.updates) >= self.maxsize:
+            match self.overflow:
+                case OverflowPolicy.drop_oldest:
+                    self.updates.popleft().mark_done()
+                    self.dropped += 1
+                case OverflowPolicy.shed if not self.is_essential(update):
+                    update.mark_done()
+                    self.dropped += 1
+                    return
+                case OverflowPolicy.shed if self._shed_one():
+                    self.dropped += 1
+                case _:
+                    self.not_full.clear()
+                    await self.not_full.wait()
+
+        self._append(update)
+
+    def put_nowait(self, update: Update) -> bool:
+        """Как put, но вместо ожидания места отбрасывает само обновление; возвращает, принято ли оно"""
+
+        if len(self.updates) >= self.maxsize:
+            match self.overflow:
+                case OverflowPolicy.drop_oldest:
+                    self.updates.popleft().mark_done()
+                    self.dropped += 1
+                case OverflowPolicy.shed if self.is_essential(update) and self._shed_one():
+                    self.dropped += 1
+                case _:
+                    update.mark_done()
+                    self.dropped += 1
+                    return False
+
+        self._append(update)
+        return True
+
+    def _append(self, update: Update):
+        self.updates.append(update)
+        self.queued += 1
+        self.not_empty.set()
+
+    def __len__(self) -> int:
+        return len(self.updates)
+
+    def _shed_one(self) -> bool:
+        for queued_update in self.updates:
+            if not self.is_essential(queued_update):
+                self.updates.remove(queued_update)
+                queued_update.mark_done()
+                return True
+        return False
+
+    async def wait(self):
+        while not self.updates:
+            self.not_empty.clear()
+            await self.not_empty.wait()
+
+    def take(self, limit: int) -> list[Update]:
+        batch = [self.updates.popleft() for _ in range(min(limit, len(self.updates)))]
+        self.not_full.set()
+        return batch
+
+    def mark_processed(self):
+        self.processed += 1
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self.updates),
+            "maxsize": self.maxsize,
+            "overflow": self.overflow.value,
+            "queued": self.queued,
+            "dropped": self.dropped,
+            "processed": self.processed,
+        }
@@ -1,6 +1,6 @@
 import typing
 import yaml
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
 if typing.TYPE_CHECKING:
     from app.web.app import Application
@@ -17,11 +17,105 @@ class AdminConfig:
     password: str
 
 
+@dataclass
+class GroupConfig:
+    token: str
+    group_id: int
+    admin_id: int
+    confirmation: str = ""
+    secret: str = ""
+
+
 @dataclass
 class BotConfig:
     token: str
     group_id: int
     admin_id: int
+    mode: str = "long_poll"
+    groups: list[GroupConfig] = field(default_factory=list)
+
+
+@dataclass
+class CallbackConfig:
+    confirmation: str = ""
+    secret: str = ""
+
+
+@dataclass
+class DispatcherConfig:
+    workers: int = 8
+    max_pending: int = 1000  # обновлений в очередях бесед и в обработке; дальше ждёт очередь пуллера
+
+
+@dataclass
+class GameStateConfig:
+    flush_interval: float = 0.5  # как долго копить изменения игр перед записью в базу
+    batch_size: int = 500  # запросов в одной транзакции
+    retry_delay: float = 5.0  # пауза перед новой попыткой, если база недоступна
+
+
+@dataclass
+class DedupConfig:
+    ttl: float = 600
+    chat_size: int = 256
+    max_chats: int = 10000
+
+
+@dataclass
+class ThrottleConfig:
+    rate: float = 0.5  # одинаковых команд в секунду от пользователя в беседе
+    burst: float = 3
+    max_keys: int = 10000
+
+
+@dataclass
+class PollerConfig:
+    queue_size: int = 1000
+    overflow: str = "block"
+    batch_size: int = 100
+    drain_timeout: float = 30.0
+
+
+@dataclass
+class VkApiConfig:
+    batching: bool = True
+    batch_window: float = 0.05
+    batch_size: int = 25
+    rate_limit: float = 18  # VK разрешает сообществу 20 запросов в секунду
+    rate_burst: float = 2
+    upload_concurrency: int = 8
+    upload_url_ttl: float = 600
+    retry_attempts: int = 3
+    retry_base_delay: float = 0.5
+    retry_max_delay: float = 10.0
+    retry_jitter: float = 0.5
+    breaker_threshold: int = 5
+    breaker_reset_timeout: float = 30.0
+    chat_members_ttl: float = 300
+    chat_members_cache_size: int = 1000
+
+
+@dataclass
+class RenderConfig:
+    backend: str = "pillow"  # pillow или dataframe (pandas + dataframe_image)
+    font: str = ""  # путь или имя TrueType шрифта для чисел, по умолчанию DejaVu Sans Bold или Arial Bold
+    caption_font: str = ""
+    executor: str = "process"  # process, thread или none - рисовать прямо в цикле событий
+    workers: int = 2
+    layout: str = "composite"  # composite - карточки игроков общими изображениями, cards - по одной, text - текстом
+    composite_size: int = 10  # карточек в одном общем изображении
+    composite_columns: int = 2
+    png_palette: int = 16  # цветов в палитре PNG, 0 - полноцветный PNG
+    png_compress_level: int = 6
+    png_optimize: bool = False
+    scale: float = 1.0  # масштаб загружаемых изображений
+    dump_files: bool = False  # для отладки дополнительно сохранять карточки в images/
+    cache_ttl: float = 86400  # сколько помнить загруженные карточки сессии
+    cache_sessions: int = 1000
+    # под нагрузкой ходы идут с карточками текстом, без отрисовки и загрузки; 0 - не переключаться
+    text_render_queue: int = 40  # карточек в очереди отрисовки
+    text_upload_latency: float = 5.0  # секунд на загрузку документа вместе с ожиданием очереди загрузок
+    text_latency_window: float = 60.0  # сколько секунд после медленной загрузки учитывать её длительность
 
 
 @dataclass
@@ -39,6 +133,14 @@ class Config:
     session: SessionConfig = None
     bot: BotConfig = None
     database: DatabaseConfig = None
+    dispatcher: DispatcherConfig = None
+    game_state: GameStateConfig = None
+    dedup: DedupConfig = None
+    throttle: ThrottleConfig = None
+    poller: PollerConfig = None
+    vk_api: VkApiConfig = None
+    callback: CallbackConfig = None
+    render: RenderConfig = None
 
 
 @dataclass
@@ -58,6 +160,16 @@ def setup_config(app: "Application", config_path: str):
     with open(config_path, "r") as f:
         raw_config = yaml.safe_load(f)
 
+    # несколько сообществ задаются списком bot.groups, одно - прямо в секции bot
+    if "groups" in raw_config["bot"]:
+        groups = [GroupConfig(**group) for group in raw_config["bot"]["groups"]]
+    else:
+        groups = [GroupConfig(
+            token=raw_config["bot"]["token"],
+            group_id=raw_config["bot"]["group_id"],
+            admin_id=raw_config["bot"]["admin_id"],
+        )]
+
     app.config = Config(
         session=SessionConfig(
             key=raw_config["session"]["key"],
@@ -67,13 +179,29 @@ def setup_config(app: "Application", config_path: str):
             password=raw_config["admin"]["password"],
         ),
         bot=BotConfig(
-            token=raw_config["bot"]["token"],
-            group_id=raw_config["bot"]["group_id"],
-            admin_id=raw_config["bot"]["admin_id"]
+            token=groups[0].token,
+            group_id=groups[0].group_id,
+            admin_id=groups[0].admin_id,
+            mode=raw_config["bot"].get("mode", "long_poll"),
+            groups=groups
         ),
         database=DatabaseConfig(**raw_config["database"]),
+        dispatcher=DispatcherConfig(**raw_config.get("dispatcher", {})),
+        game_state=GameStateConfig(**raw_config.get("game_state", {})),
+        dedup=DedupConfig(**raw_config.get("dedup", {})),
+        throttle=ThrottleConfig(**raw_config.get("throttle", {})),
+        poller=PollerConfig(**raw_config.get("poller", {})),
+        vk_api=VkApiConfig(**raw_config.get("vk_api", {})),
+        callback=CallbackConfig(**raw_config.get("callback", {})),
+        render=RenderConfig(**raw_config.get("render", {})),
     )
 
+    if app.config.bot.mode == "callback":
+        # без секрета кто угодно может прислать поддельное событие от имени любого участника беседы
+        for group in groups:
+            if not (group.secret or app.config.callback.secret):
+                raise ValueError(f"group {group.group_id}: callback mode requires a secret")
+
 
 def setup_cards_config(app: "Application", cards_config_path: str):
     with open(cards_config_path, "r") as f:
@@ -0,0 +1,50 @@
+"""Размер и время кодирования карточек при разных настройках PNG: палитра, уровень сжатия, масштаб.
+
+Меряется отдельная карточка и общее изображение из COMPOSITE_SIZE карточек, размер приводится на одну карточку.
+Запуск из корня проекта: python -m benchmarks.card_encoding
+"""
+import time
+
+from app.store.bot.card_renderer import EncodeOptions, PillowCardRenderer
+from benchmarks.card_renderer import BARREL_PATH, make_cards
+
+ROUNDS = 10
+COMPOSITE_SIZE = 10
+OPTIONS = {
+    "rgb": EncodeOptions(),
+    "rgb level 1": EncodeOptions(compress_level=1),
+    "rgb optimize": EncodeOptions(optimize=True),
+    "palette 32": EncodeOptions(palette=32),
+    "palette 16": EncodeOptions(palette=16),
+    "palette 16 level 9": EncodeOptions(palette=16, compress_level=9),
+    "palette 16 optimize": EncodeOptions(palette=16, optimize=True),
+    "palette 16 scale 0.75": EncodeOptions(palette=16, scale=0.75),
+    "palette 8 scale 0.5": EncodeOptions(palette=8, scale=0.5),
+}
+
+
+def measure(name: str, encoding: EncodeOptions, cards):
+    renderer = PillowCardRenderer(BARREL_PATH, encoding=encoding)
+    renderer.warm_up({card.number: card.numbers for card in cards})
+    single = renderer.render(cards[0])
+    composite = renderer.composite(cards, 2)
+
+    results = []
+    for image, amount in ((single, 1), (composite, len(cards))):
+        renderer.encode(image)
+        started = time.perf_counter()
+        for _ in range(ROUNDS):
+            picture = renderer.encode(image)
+        elapsed = (time.perf_counter() - started) / ROUNDS
+        results.append(f"{len(picture) / amount:9,.0f} B/card {elapsed * 1000 / amount:6.1f} ms/card")
+    print(f"{name:>22}: single {results[0]} | composite {results[1]}")
+
+
+def main():
+    cards = make_cards(COMPOSITE_SIZE)
+    for name, encoding in OPTIONS.items():
+        measure(name, encoding, cards)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""Скорость отрисовки карточек и пиковая память процесса: PillowCardRenderer против pandas + dataframe_image.
+
+Каждый бэкенд меряется в отдельном процессе, чтобы пиковый RSS одного не влиял на другой.
+Затем меряется задержка цикла событий, пока карточки большой игры рисуются в нём самом и в пуле процессов.
+Запуск из корня проекта: python -m benchmarks.card_renderer
+"""
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import yaml
+
+from app.store.bot.card_renderer import (
+    CardData, DataFrameCardRenderer, EncodeOptions, PillowCardRenderer, init_render_worker, render_in_worker
+)
+
+CARDS_CONFIG_PATH = "app/store/bot/cards_config.yml"
+BARREL_PATH = "images/barrel.png"
+CARDS = {"pillow": 500, "dataframe": 10}
+GAME_CARDS = 24  # полная игра: все карточки перерисовываются за ход
+MOVES = 10
+WORKERS = 2
+ENCODING = EncodeOptions(palette=16)  # как в RenderConfig по умолчанию
+BACKENDS = {
+    "pillow": lambda: PillowCardRenderer(BARREL_PATH, encoding=ENCODING),
+    "dataframe": lambda: DataFrameCardRenderer(os.path.abspath(BARREL_PATH), ENCODING),
+}
+
+
+def make_cards(amount: int) -> list[CardData]:
+    with open(CARDS_CONFIG_PATH, "r") as f:
+        raw_cards = yaml.safe_load(f)["cards"]
+
+    random.seed(0)
+    cards = []
+    for i in range(amount):
+        card_number = i % len(raw_cards) + 1
+        numbers = [raw_cards[card_number][row] for row in (1, 2, 3)]
+        cards.append(CardData(
+            number=card_number,
+            numbers=numbers,
+            covered=[[bool(number) and random.random() < 0.4 for number in row] for row in numbers],
+            caption=[f"Карта №{card_number}", "Игрок - Иван Иванов"],
+        ))
+    return cards
+
+
+def peak_rss_mb() -> float:
+    try:
+        import resource
+    except ImportError:  # Windows
+        return float("nan")
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure(backend: str):
+    try:
+        renderer = BACKENDS[backend]()
+        cards = make_cards(CARDS[backend])
+        renderer.warm_up({card.number: card.numbers for card in cards})
+        renderer.to_bytes(cards[0])  # прогрев: шрифты, браузер/matplotlib у dataframe_image
+        started = time.perf_counter()
+        for card in cards:
+            renderer.to_bytes(card)
+        elapsed = time.perf_counter() - started
+    except Exception as e:
+        print(f"{backend:>10}: unavailable ({e!r})")
+        return
+    print(f"{backend:>10}: {len(cards) / elapsed:8.1f} cards/s, peak RSS {peak_rss_mb():7.1f} MB")
+
+
+async def measure_loop_lag(name: str, executor: ProcessPoolExecutor | None):
+    renderer = PillowCardRenderer(BARREL_PATH, encoding=ENCODING)
+    cards = make_cards(GAME_CARDS)
+    renderer.warm_up({card.number: card.numbers for card in cards})
+    loop = asyncio.get_running_loop()
+    max_lag = 0.0
+    is_rendering = True
+
+    async def tick():
+        nonlocal max_lag
+        while is_rendering:
+            started = time.perf_counter()
+            await asyncio.sleep(0.001)
+            max_lag = max(max_lag, time.perf_counter() - started - 0.001)
+
+    ticker = asyncio.create_task(tick())
+    started = time.perf_counter()
+    for _ in range(MOVES):
+        await asyncio.sleep(0)  # между ходами цикл событий успевает обработать остальное
+        if executor is None:
+            for card in cards:
+                renderer.to_bytes(card)
+        else:
+            await asyncio.gather(*[loop.run_in_executor(executor, render_in_worker, card) for card in cards])
+    elapsed = time.perf_counter() - started
+    is_rendering = False
+    await ticker
+    print(f"{name:>10}: {MOVES} moves × {GAME_CARDS} cards in {elapsed:5.2f} s, max loop lag {max_lag * 1000:7.1f} ms")
+
+
+async def compare_loop_lag():
+    cards = {card.number: card.numbers for card in make_cards(GAME_CARDS)}
+    await measure_loop_lag("inline", None)
+    with ProcessPoolExecutor(WORKERS, initializer=init_render_worker, initargs=(
+            "pillow", BARREL_PATH, "", "", ENCODING, cards
+    )) as executor:
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[loop.run_in_executor(executor, int) for _ in range(WORKERS)])
+        await measure_loop_lag("process", executor)
+
+
+def main():
+    if len(sys.argv) > 1:
+        measure(sys.argv[1])
+        return
+    for backend in BACKENDS:
+        subprocess.run([sys.executable, "-m", "benchmarks.card_renderer", backend], check=False)
+    asyncio.run(compare_loop_lag())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""Сравнение пропускной способности CommandRouter и прежнего суммирования битовых флагов.
+
+Запуск из корня проекта: python -m benchmarks.command_router
+"""
+import re
+import timeit
+
+from app.store.bot.router import CommandRouter
+
+GROUP_ID = 221234567
+MESSAGES = [
+    "Привет!", "Начать лото 2!", f"[club{GROUP_ID}|@yasb], начать лото", "+", "Заполнить мешок!",
+    "Ход!", f"[club{GROUP_ID}|yasb] Ход 5", "Стоп лото", "всем привет", "ну что, играем?",
+]
+ROUNDS = 20_000
+
+LEGACY_PATTERNS = {
+    "greetings": r"Привет!", "start_loto": r"([Нн]ачать) (лото)( [1|2])? ?!?",
+    "join_loto": r"\+", "fill_bag": r"([Зз]аполнить) (мешок|мешочек) ?!?",
+    "game_move": r"([Хх]од)( (10|[1-9]))? ?!?", "stop_loto": r"([Сс]топ) (лото) ?!?",
+}
+LEGACY_MENTION = rf"(\[club{GROUP_ID}\|[@]?[а-яА-Яa-zA-Z_0-9 ]+\][,]?)"
+
+
+def legacy_route(msg: str):
+    flags = sum([
+        int(re.fullmatch(rf"({LEGACY_MENTION} )?{cmd}", msg) is not None) << i
+        for i, cmd in enumerate(LEGACY_PATTERNS.values())
+    ])
+    if flags in (0b000010, 0b010000):
+        return flags, re.sub(r"\D", "", msg)
+    return flags, None
+
+
+def main():
+    router = CommandRouter()
+    total = ROUNDS * len(MESSAGES)
+    for name, route in (("legacy flags", legacy_route), ("CommandRouter", lambda msg: router.route(msg, GROUP_ID))):
+        elapsed = timeit.timeit(lambda: [route(msg) for msg in MESSAGES], number=ROUNDS)
+        print(f"{name:>14}: {total / elapsed:12,.0f} msg/s")
+
+
+if __name__ == "__main__":
+    main()
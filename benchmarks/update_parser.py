@@ -0,0 +1,85 @@
+"""Скорость разбора событий long poll и память на одно событие: UpdateParser против прежнего разбора в Poller.
+
+Запуск из корня проекта: python -m benchmarks.update_parser
+"""
+import time
+import tracemalloc
+from dataclasses import dataclass
+
+from app.store.vk_api.parser import UpdateParser
+
+GROUP_ID = 221234567
+BATCH = 100_000
+ROUNDS = 5
+
+
+@dataclass
+class LegacyUpdateObject:
+    id: int
+    user_id: int
+    body: str
+    peer_id: int
+    message_id: int
+
+
+@dataclass
+class LegacyUpdate:
+    type: str
+    object: LegacyUpdateObject
+
+
+def legacy_parse(raw_updates: list[dict]) -> list[LegacyUpdate]:
+    return [
+        LegacyUpdate(
+            type="chat_invite_yasb" if "action" in raw_update["object"]["message"] and
+            raw_update["object"]["message"]["action"]["type"] and
+            raw_update["object"]["message"]["action"]["member_id"] == -GROUP_ID else raw_update["type"],
+            object=LegacyUpdateObject(
+                id=raw_update["object"]["message"]["id"],
+                user_id=raw_update["object"]["message"]["from_id"],
+                body=raw_update["object"]["message"]["text"],
+                peer_id=raw_update["object"]["message"]["peer_id"],
+                message_id=raw_update["object"]["message"]["conversation_message_id"]
+            )
+        ) for raw_update in raw_updates if (raw_update["type"] == "message_new")
+    ]
+
+
+def make_raw_updates(amount: int) -> list[dict]:
+    raw_updates = []
+    for i in range(amount):
+        message = {
+            "id": 0, "from_id": 1000 + i % 50, "text": "Ход!" if i % 3 else "+",
+            "peer_id": 2000000000 + i % 20, "conversation_message_id": i,
+        }
+        if i % 97 == 0:
+            message["action"] = {"type": "chat_invite_user", "member_id": -GROUP_ID}
+        elif i % 89 == 0:
+            message["action"] = {"type": "chat_kick_user", "member_id": 1000}
+        raw_type = "message_reply" if i % 10 == 0 else "message_new"
+        raw_updates.append({"type": raw_type, "event_id": f"{i:040x}", "object": {"message": message}})
+    return raw_updates
+
+
+def measure(name: str, parse, raw_updates: list[dict]):
+    elapsed = float("inf")
+    for _ in range(ROUNDS):
+        started = time.perf_counter()
+        parse(raw_updates)
+        elapsed = min(elapsed, time.perf_counter() - started)
+
+    tracemalloc.start()
+    parsed = parse(raw_updates)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:>12}: {len(raw_updates) / elapsed:12,.0f} events/s, {size / len(parsed):6.0f} B/event")
+
+
+def main():
+    raw_updates = make_raw_updates(BATCH)
+    measure("legacy", legacy_parse, raw_updates)
+    measure("UpdateParser", UpdateParser(GROUP_ID).parse_batch, raw_updates)
+
+
+if __name__ == "__main__":
+    main()
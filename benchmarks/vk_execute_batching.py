@@ -0,0 +1,80 @@
+"""Количество HTTP-запросов к VK с пакетированием через execute и без него.
+
+Поднимает локальный фейковый API и отправляет через VkApiAccessor пачку сообщений
+из нескольких бесед одновременно, как это происходит при ходах в разных играх.
+
+Запуск из корня проекта: python -m benchmarks.vk_execute_batching
+"""
+import asyncio
+import time
+from functools import partial
+from types import SimpleNamespace
+
+from aiohttp import ClientSession, web
+
+from app.store.vk_api.accessor import VkApiAccessor
+from app.store.vk_api.batcher import ExecuteBatcher
+from app.store.vk_api.dataclasses import Message
+from app.web.config import GroupConfig, VkApiConfig
+
+HOST, PORT = "127.0.0.1", 8089
+API_LATENCY = 0.02
+CHATS = 16
+MESSAGES_PER_CHAT = 5
+
+
+async def fake_method(request: web.Request) -> web.Response:
+    request.app["stats"]["requests"] += 1
+    await asyncio.sleep(API_LATENCY)
+    if request.match_info["method"] == "execute":
+        code = (await request.post())["code"]
+        return web.json_response({"response": [1] * code.count("API.")})
+    return web.json_response({"response": 1})
+
+
+async def run(batching: bool, api: web.Application) -> tuple[int, float]:
+    api["stats"]["requests"] = 0
+    app = SimpleNamespace(
+        on_startup=[], on_cleanup=[],
+        config=SimpleNamespace(
+            bot=SimpleNamespace(groups=[GroupConfig(token="token", group_id=1, admin_id=1)]),
+            vk_api=VkApiConfig(batching=batching),
+        ),
+    )
+    accessor = VkApiAccessor(app)
+    accessor.API_PATH = f"http://{HOST}:{PORT}/method/"
+    accessor.session = ClientSession()
+    group = accessor.group
+    if batching:
+        group.batcher = ExecuteBatcher(partial(accessor._execute, group), app.config.vk_api.batch_window)
+
+    async def chat(peer_id: int):
+        for i in range(MESSAGES_PER_CHAT):
+            await accessor.send_message(Message(user_id=1, text=f"Ход {i}"), peer_id)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[chat(2000000000 + i) for i in range(CHATS)])
+    elapsed = time.perf_counter() - started
+    await accessor.session.close()
+    return api["stats"]["requests"], elapsed
+
+
+async def main():
+    api = web.Application()
+    api["stats"] = {"requests": 0}
+    api.router.add_route("*", "/method/{method}", fake_method)
+    runner = web.AppRunner(api)
+    await runner.setup()
+    await web.TCPSite(runner, HOST, PORT).start()
+
+    total = CHATS * MESSAGES_PER_CHAT
+    for batching in (False, True):
+        requests, elapsed = await run(batching, api)
+        print(f"batching={batching!s:5}: {total} messages, {requests} HTTP requests, {elapsed:.3f} s")
+    await runner.cleanup()
+
+
+if __name__ == "__main__":
+    import logging
+    logging.disable(logging.INFO)
+    asyncio.run(main())